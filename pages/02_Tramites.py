@@ -1,30 +1,37 @@
 # app/pages/02_Tramites.py
 from __future__ import annotations
 
+import functools
+import hashlib
+import io
 import re
+import pandas as pd
 import streamlit as st
 from datetime import datetime
 
 from transit_core.gsheets_db import (
+    init_db,
     list_clients,
     list_cases,
+    list_cases_overview,
+    prefetch_records,
     get_case,
+    get_client,
     create_case,
     update_case_fields,
     list_vehicles,
+    list_case_vins,
     list_articles,
     add_vehicle,
     add_article,
     list_documents,
     add_document,
+    add_documents,
 )
-from transit_core.drive_bridge import (
-    create_case_folder_via_script,
-    upload_file_to_case_folder_via_script,
-)
+from transit_core.concurrency import BACKGROUND_WORKERS, run_parallel, submit_background
+from transit_core.dictation import build_article_description, parse_article_dictation
 from transit_core.ids import next_case_id
 from transit_core.validators import normalize_vin, is_valid_vin
-from transit_core.vin_decode import decode_vin
 
 from transit_core.pdf_builder import build_case_summary_pdf_bytes
 
@@ -33,124 +40,84 @@ st.set_page_config(page_title="Trámites", layout="wide")
 st.title("Trámites")
 
 OFFICE_EDIT_CODE = "778899"
+MAX_TABLE_ROWS = 100  # tope de filas enviadas al navegador por tabla
+MAX_CASE_OPTIONS = 200  # tope de opciones en el selector de trámites
+MAX_CASE_LIST_ROWS = 200  # tope de filas del listado de trámites
+ERR_TEXT_MAX = 2048  # caracteres de un error que se muestran en pantalla
+# Columnas que ve el operador en "registrados" (no ids internos, source, created_at...)
+_VEHICLE_VIEW_COLS = ["vin", "brand", "model", "year", "vehicle_type", "weight", "value"]
+_CASE_LIST_COLS = ["case_id", "client_name", "status", "origin", "destination", "drive_folder_id", "created_at", "updated_at"]
+_ARTICLE_VIEW_COLS = ["item_type", "ref", "brand", "model", "condition", "quantity", "weight", "value", "is_vehicle_part", "parent_vin"]
+# Caches por trámite en session_state que se pueden recalcular (no estado de widgets)
+_CASE_DERIVED_KEYS = ("_vin_check_", "_parsed_dict_", "_desc_")
 DOC_TYPES = ["ID_CLIENTE", "TITULO_VEHICULO", "FACTURA_VEHICULO", "FACTURA_ARTICULO", "OTRO"]
 
+# Regex a nivel de módulo (no se arma el patrón en cada llamada)
+_DRIVE_ID_RE = re.compile(r"[A-Za-z0-9_\-]+")
+
 
 # ----------------------------
-# Helpers
+# Memo por rerun: la misma lectura dentro de un rerun se hace una sola vez
 # ----------------------------
-def _safe(s: str) -> str:
-    return (s or "").strip()
+_rerun_cache: dict = {}
+
 
+def _memo_rerun(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (fn, args, frozenset(kwargs.items()))
+        if key not in _rerun_cache:
+            _rerun_cache[key] = fn(*args, **kwargs)
+        return _rerun_cache[key]
 
-def _norm_spaces(s: str) -> str:
-    return re.sub(r"\s+", " ", _safe(s))
+    return wrapper
 
 
-def _case_label(case_row: dict, clients_df) -> str:
-    cid = str(case_row.get("case_id", ""))
-    client_id = str(case_row.get("client_id", ""))
-    status = str(case_row.get("status", ""))
-    client_name = ""
-    if clients_df is not None and not clients_df.empty and "client_id" in clients_df.columns:
-        m = clients_df[clients_df["client_id"].astype(str) == client_id]
-        if not m.empty:
-            client_name = str(m.iloc[0].get("name", "")).strip()
-    return f"{cid} — {client_name} ({status})".strip()
+list_clients = _memo_rerun(list_clients)
+list_cases = _memo_rerun(list_cases)
+list_cases_overview = _memo_rerun(list_cases_overview)
+get_case = _memo_rerun(get_case)
+get_client = _memo_rerun(get_client)
+list_vehicles = _memo_rerun(list_vehicles)
+list_case_vins = _memo_rerun(list_case_vins)
+list_articles = _memo_rerun(list_articles)
+list_documents = _memo_rerun(list_documents)
 
 
-def _parse_article_dictation(text: str) -> dict:
+# ----------------------------
+# Helpers
+# ----------------------------
+def _err_text(e: Exception) -> str:
     """
-    Dictado continuo:
-    tipo lavadora ref 440827 marca Sienna modelo Sleep4415 peso 95 lb estado usado cantidad 1 valor 120 parte_vehiculo no
+    "Tipo: mensaje" acotado: un APIError/HttpError puede traer el cuerpo completo de la respuesta.
     """
-    t = _norm_spaces(text)
-    data = {
-        "type": "",
-        "ref": "",
-        "brand": "",
-        "model": "",
-        "weight": "",
-        "condition": "",
-        "quantity": 1,
-        "is_vehicle_part": False,
-        "parent_vin": "",
-        "value": "",
-    }
-    if not t:
-        return data
-
-    aliases = {
-        "tipo": "type", "type": "type",
-        "ref": "ref", "referencia": "ref", "serie": "ref", "serial": "ref",
-        "marca": "brand", "brand": "brand",
-        "modelo": "model", "model": "model",
-        "peso": "weight", "weight": "weight",
-        "estado": "condition", "condition": "condition",
-        "cantidad": "quantity", "qty": "quantity", "quantity": "quantity",
-        "parte_vehiculo": "is_vehicle_part", "partevehiculo": "is_vehicle_part",
-        "parte": "is_vehicle_part", "vehicle_part": "is_vehicle_part",
-        "vin": "parent_vin", "vin_padre": "parent_vin", "parent_vin": "parent_vin",
-        "valor": "value", "value": "value",
-    }
-
-    tokens = t.split(" ")
-    i = 0
-    current_key = None
-    buff = []
-
-    def flush():
-        nonlocal current_key, buff
-        if not current_key:
-            buff = []
-            return
-        val = _norm_spaces(" ".join(buff))
-        if current_key == "quantity":
-            try:
-                data["quantity"] = int(re.findall(r"\d+", val)[0])
-            except Exception:
-                data["quantity"] = 1
-        elif current_key == "is_vehicle_part":
-            v = val.lower()
-            data["is_vehicle_part"] = v in ("si", "sí", "yes", "true", "1")
-        elif current_key == "parent_vin":
-            data["parent_vin"] = normalize_vin(val)
-        else:
-            data[current_key] = val
-        buff = []
+    msg = str(e)
+    if len(msg) > ERR_TEXT_MAX:
+        msg = msg[:ERR_TEXT_MAX] + "…"
+    return f"{type(e).__name__}: {msg}"
 
-    while i < len(tokens):
-        tok = tokens[i].lower().strip()
-        tok_clean = re.sub(r"[^\wáéíóúüñ_]+", "", tok)
 
-        if tok_clean in aliases:
-            flush()
-            current_key = aliases[tok_clean]
-            buff = []
-        else:
-            buff.append(tokens[i])
-        i += 1
-    flush()
-
-    return data
-
-
-def _build_article_description(d: dict) -> str:
-    parts = []
-    if d.get("type"): parts.append(f"Tipo: {d['type']}")
-    if d.get("ref"): parts.append(f"Ref: {d['ref']}")
-    if d.get("brand"): parts.append(f"Marca: {d['brand']}")
-    if d.get("model"): parts.append(f"Modelo: {d['model']}")
-    if d.get("weight"): parts.append(f"Peso: {d['weight']}")
-    if d.get("condition"): parts.append(f"Estado: {d['condition']}")
-    parts.append(f"Cantidad: {int(d.get('quantity') or 1)}")
-    if d.get("value"): parts.append(f"Valor: {d['value']}")
-    if d.get("is_vehicle_part"):
-        pv = normalize_vin(d.get("parent_vin", ""))
-        parts.append(f"Parte de vehículo: {pv if pv else 'SI'}")
-    else:
-        parts.append("Parte de vehículo: NO")
-    return " | ".join(parts).strip()
+def _safe(s: str) -> str:
+    return (s or "").strip()
+
+
+def _case_labels(cases_df: pd.DataFrame) -> list[str]:
+    """
+    Etiquetas "case_id — cliente (status)" para todo el DataFrame en una pasada.
+    cases_df viene de list_cases_overview(): client_name ya viene unido (y cacheado).
+    """
+    n = len(cases_df)
+
+    def col(name: str) -> list[str]:
+        if name in cases_df.columns:
+            return cases_df[name].astype(str).tolist()
+        return [""] * n
+
+    # Un f-string por fila: una sola cadena por etiqueta, sin Series intermedias por cada "+"
+    return [
+        f"{cid} — {name.strip()} ({status})".strip()
+        for cid, name, status in zip(col("case_id"), col("client_name"), col("status"))
+    ]
 
 
 def _looks_like_drive_id(s: str) -> bool:
@@ -158,7 +125,7 @@ def _looks_like_drive_id(s: str) -> bool:
     if len(s) < 18:
         return False
     # Drive id típico: letras/números/guiones/guion bajo
-    return bool(re.fullmatch(r"[A-Za-z0-9_\-]+", s))
+    return bool(_DRIVE_ID_RE.fullmatch(s))
 
 
 def _doc_type_from_row(row: dict) -> str:
@@ -185,6 +152,57 @@ def _doc_type_from_row(row: dict) -> str:
     return dt or "OTRO"
 
 
+def _doc_types_column(df: pd.DataFrame) -> list[str]:
+    """
+    _doc_type_from_row para todo el DataFrame, sin apply(axis=1) (que arma una Series por fila).
+    """
+    n = len(df)
+    dts = df["doc_type"].tolist() if "doc_type" in df.columns else [""] * n
+    dfids = df["drive_file_id"].tolist() if "drive_file_id" in df.columns else [""] * n
+    return [_doc_type_from_row({"doc_type": dt, "drive_file_id": dfid}) for dt, dfid in zip(dts, dfids)]
+
+
+def _submit_sig(*parts) -> str:
+    """
+    Firma corta de un envío, para ignorar doble-click / reenvíos del mismo contenido.
+    """
+    raw = "|".join(str(p) for p in parts)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _rows_cap(df, case_id: str):
+    """
+    Recorta la tabla a MAX_TABLE_ROWS salvo que el usuario pida "Ver todos".
+    """
+    if st.session_state.get(f"show_all_{case_id}", False):
+        return df
+    return df.head(MAX_TABLE_ROWS)
+
+
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def _case_pdf_bytes(case: dict, client: dict, vehicles_df: pd.DataFrame, articles_df: pd.DataFrame, documents_df: pd.DataFrame) -> bytes:
+    """
+    PDF resumen cacheado por contenido (st.cache_data hashea dicts y DataFrames):
+    reintentar con los mismos datos no vuelve a dibujar el PDF.
+    """
+    return build_case_summary_pdf_bytes(
+        case=case,
+        client=client,
+        vehicles_df=vehicles_df,
+        articles_df=articles_df,
+        documents_df=documents_df,
+    )
+
+
+def _numbered_view(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
+    """
+    Solo las columnas visibles (menos payload Arrow al navegador) + columna "No.".
+    """
+    view = df[[c for c in cols if c in df.columns]].reset_index(drop=True)
+    view.insert(0, "No.", range(1, len(view) + 1))
+    return view
+
+
 # ----------------------------
 # Style (corporativo)
 # ----------------------------
@@ -272,22 +290,29 @@ tab_create, tab_manage, tab_list = st.tabs(["➕ Crear trámite", "🧾 Gestiona
 # =========================================================
 # TAB 1: Crear trámite
 # =========================================================
-with tab_create:
+@st.fragment
+def _render_create_tab() -> None:
+    _rerun_cache.clear()  # un rerun de fragment no re-ejecuta el inicio de la página
     st.subheader("Crear trámite")
 
-    clients_df = list_clients().fillna("")
+    clients_df = list_clients()
     if clients_df.empty:
         st.warning("No hay clientes. Crea uno primero.")
         st.stop()
 
-    clients_df["label"] = clients_df["client_id"].astype(str) + " — " + clients_df["name"].astype(str)
+    # Opciones = client_id; etiqueta y nombre salen del mismo frame (un solo snapshot de la hoja)
+    client_ids = clients_df["client_id"].astype(str).tolist()
+    name_by_id = dict(zip(client_ids, clients_df["name"].astype(str).str.strip()))
 
     c1, c2, c3 = st.columns([2, 2, 3])
     with c1:
-        selected_label = st.selectbox("Cliente", clients_df["label"].tolist(), key="create_case_client")
-        row = clients_df.loc[clients_df["label"] == selected_label].iloc[0]
-        client_id = str(row["client_id"])
-        client_name = str(row["name"]).strip()
+        client_id = st.selectbox(
+            "Cliente",
+            client_ids,
+            format_func=lambda cid: f"{cid} — {name_by_id[cid]}",
+            key="create_case_client_id",
+        )
+        client_name = name_by_id[client_id]
 
     with c2:
         origin = st.text_input("Origen", value="USA", key="create_case_origin")
@@ -297,67 +322,163 @@ with tab_create:
         notes = st.text_input("Notas (opcional)", value="", key="create_case_notes")
 
     if st.button("Crear trámite", type="primary", key="create_case_btn"):
+        # import perezoso: requests/Drive solo cuando realmente se usa
+        from transit_core.drive_bridge import create_case_folder_via_script
+
         try:
-            cases_df = list_cases().fillna("")
+            cases_df = list_cases()
             existing_ids = cases_df["case_id"].tolist() if "case_id" in cases_df.columns else []
             year = datetime.now().year
             case_id_new = next_case_id(existing_ids, year=year)
 
             folder_name = f"{case_id_new} - {client_name}".strip()
 
-            res = create_case_folder_via_script(case_id=case_id_new, folder_name=folder_name)
-            drive_folder_id = res["folder_id"]
-
-            created_case_id = create_case(
-                client_id=client_id,
-                origin=_safe(origin) or "USA",
-                destination=_safe(destination),
-                notes=_safe(notes),
-                drive_folder_id=drive_folder_id,
-            )
+            # Carpeta primero y luego un solo append con el drive_folder_id: si la carpeta falla
+            # no queda fila sin carpeta, y el trámite se escribe una sola vez
+            with st.spinner("Creando carpeta y guardando trámite..."):
+                res = create_case_folder_via_script(case_id=case_id_new, folder_name=folder_name)
+                created_case_id = create_case(
+                    client_id=client_id,
+                    origin=_safe(origin) or "USA",
+                    destination=_safe(destination),
+                    notes=_safe(notes),
+                    drive_folder_id=res["folder_id"],
+                    case_id=case_id_new,
+                )
 
             st.success(f"Trámite creado: {created_case_id}")
             st.info(f"Carpeta Drive: {folder_name}")
             st.rerun()
 
         except Exception as e:
-            st.error(f"Error creando trámite: {type(e).__name__}: {e}")
+            st.error(f"Error creando trámite: {_err_text(e)}")
+
+
+with tab_create:
+    _render_create_tab()
 
 
 # =========================================================
 # TAB 3: Listado & estatus
 # =========================================================
-with tab_list:
+@st.fragment
+def _render_list_tab() -> None:
+    _rerun_cache.clear()  # un rerun de fragment no re-ejecuta el inicio de la página
     st.subheader("Listado de trámites y estatus")
 
-    clients_df = list_clients().fillna("")
-    cases_df = list_cases().fillna("")
-    if cases_df.empty:
+    prefetch_records("cases", "clients")
+    df = list_cases_overview()
+    if df.empty:
         st.info("No hay trámites.")
     else:
-        df = cases_df.copy()
-        if not clients_df.empty and "client_id" in df.columns:
-            m = clients_df[["client_id", "name"]].copy()
-            m.columns = ["client_id", "client_name"]
-            df = df.merge(m, on="client_id", how="left")
+        show_cols = [c for c in _CASE_LIST_COLS if c in df.columns]
+        # Ya viene ordenado (más recientes primero): por defecto solo se envía el prefijo al navegador
+        show_all = st.checkbox(f"Ver todos (por defecto los {MAX_CASE_LIST_ROWS} más recientes)", key="cases_list_show_all")
+        view = df if show_all else df.head(MAX_CASE_LIST_ROWS)
+        st.dataframe(view[show_cols], use_container_width=True, hide_index=True)
 
-        show_cols = [c for c in ["case_id", "client_name", "status", "origin", "destination", "drive_folder_id", "created_at", "updated_at"] if c in df.columns]
-        st.dataframe(df[show_cols], use_container_width=True)
+
+with tab_list:
+    _render_list_tab()
 
 
 # =========================================================
 # TAB 2: Gestionar trámite
 # =========================================================
-with tab_manage:
+def _upload_batch_and_register(case_id: str, doc_type: str, case_folder_id: str, files: list) -> dict:
+    """
+    Job de fondo de un envío: sube sus archivos a Drive en paralelo y registra todos los que
+    subieron con UN solo add_documents. Corre completo aunque el usuario cambie de trámite
+    o cierre la sesión; el poll solo reporta el resultado.
+    """
+    from transit_core.drive_bridge import upload_stream_to_case_folder
+
+    def _one(f) -> tuple[dict | None, str]:
+        try:
+            up = upload_stream_to_case_folder(
+                case_folder_id=case_folder_id,
+                fileobj=f,
+                file_name=f.name,
+                mime_type=f.type or "application/octet-stream",
+            )
+            return up, ""
+        except Exception as e:
+            return None, f"{f.name}: {_err_text(e)}"
+
+    # Mismo tope que el pool de fondo: no rebasar las ejecuciones concurrentes del Apps Script
+    results = run_parallel(*[(_one, (f,), {}) for f in files], max_workers=BACKGROUND_WORKERS)
+    errors = [err for _, err in results if err]
+    docs = [
+        {"case_id": case_id, "drive_file_id": up.get("file_id", ""), "file_name": f.name, "doc_type": doc_type}
+        for f, (up, _) in zip(files, results)
+        if up is not None
+    ]
+
+    registered = 0
+    if docs:
+        try:
+            registered = len(add_documents(docs))
+        except Exception as e:
+            errors.append(f"subidos a Drive pero sin registrar ({', '.join(d['file_name'] for d in docs)}): {_err_text(e)}")
+    return {"ok": registered, "errors": errors}
+
+
+@st.fragment(run_every=2)
+def _render_pending_uploads(case_id: str) -> None:
+    """
+    Revisa los envíos en segundo plano del trámite (cada job ya sube y registra su envío).
+    Mientras queden pendientes, el fragment se re-ejecuta solo.
+    """
+    jobs_key = f"_uploads_{case_id}"
+    errors_key = f"_upload_errors_{case_id}"
+    sig_key = f"_docs_saved_sig_{case_id}"
+    pending, finished, n_ok = [], 0, 0
+    for job in st.session_state.get(jobs_key, []):
+        fut = job["future"]
+        if not fut.done():
+            pending.append(job)
+            continue
+        finished += 1
+        try:
+            res = fut.result()
+        except Exception as e:
+            res = {"ok": 0, "errors": [_err_text(e)]}
+        n_ok += res["ok"]
+        st.session_state.setdefault(errors_key, []).extend(res["errors"])
+        # Solo un envío sin errores cuenta como "ya subido"; si algo falló se puede reintentar
+        if res["errors"]:
+            if st.session_state.get(sig_key) == job["sig"]:
+                st.session_state.pop(sig_key, None)
+        else:
+            st.session_state[sig_key] = job["sig"]
+    st.session_state[jobs_key] = pending
+    if n_ok:
+        st.session_state[f"_upload_ok_{case_id}"] = st.session_state.get(f"_upload_ok_{case_id}", 0) + n_ok
+
+    if finished:
+        # Refresca toda la página para que las tablas muestren los documentos nuevos
+        st.rerun()
+    n_files = sum(job["n_files"] for job in pending)
+    st.info(f"⏳ Subiendo {n_files} archivo(s) a Drive… puedes seguir capturando.")
+
+
+@st.fragment
+def _render_manage_tab() -> None:
+    _rerun_cache.clear()  # un rerun de fragment no re-ejecuta el inicio de la página
     st.subheader("Gestionar trámite")
 
-    clients_df = list_clients().fillna("")
-    cases_df = list_cases().fillna("")
+    # Todas las pestañas que usa este tab en un solo batchGet (solo las que no estén en cache).
+    # Si el batchGet no aplica/falla, las lecturas por trámite de abajo siguen en paralelo.
+    # init_db primero en este thread, por si tiene que crear hojas.
+    init_db()
+    prefetch_records("clients", "cases", "vehicles", "articles", "documents")
+    # Trámites con client_name ya unido: el mapa cliente->nombre se arma una vez por rev, no por rerun
+    cases_df = list_cases_overview()
     if cases_df.empty:
         st.info("No hay trámites aún.")
         st.stop()
 
-    borradores = cases_df[cases_df["status"].astype(str).str.lower() == "borrador"] if "status" in cases_df.columns else cases_df
+    borradores = cases_df[cases_df["status_key"] == "borrador"] if "status_key" in cases_df.columns else cases_df
 
     allow_edit_locked = st.checkbox("Editar trámites Pendiente/Enviado (requiere código)", value=False, key="allow_edit_locked")
     office_code_ok = False
@@ -376,30 +497,49 @@ with tab_manage:
         st.warning("No hay trámites disponibles para gestionar con los filtros actuales.")
         st.stop()
 
-    options, rows = [], []
-    for _, r in cases_for_manage.iterrows():
-        rr = r.to_dict()
-        rows.append(rr)
-        options.append(_case_label(rr, clients_df))
+    options = _case_labels(cases_for_manage)
+    case_ids = cases_for_manage["case_id"].astype(str).tolist()
+    label_by_id = dict(zip(case_ids, options))
+    pos_by_id = {cid: i for i, cid in enumerate(case_ids)}
+
+    q_case = st.text_input("Buscar trámite (ID, cliente, estatus)", "", key="case_select_q").strip().lower()
+    visible = [cid for cid in label_by_id if not q_case or q_case in label_by_id[cid].lower()][:MAX_CASE_OPTIONS]
+    if not visible:
+        st.warning("Ningún trámite coincide con la búsqueda.")
+        st.stop()
+    if len(options) > MAX_CASE_OPTIONS and not q_case:
+        st.caption(f"Mostrando los {MAX_CASE_OPTIONS} trámites más recientes. Usa la búsqueda para encontrar otros.")
 
-    idx = st.selectbox("Selecciona un trámite", list(range(len(options))), format_func=lambda i: options[i], key="case_select_idx")
-    case = rows[int(idx)]
+    # Opciones = case_id (estable aunque cambie el orden/filtro); la etiqueta solo se usa para mostrar
+    selected_case_id = st.selectbox(
+        "Selecciona un trámite", visible, format_func=label_by_id.__getitem__, key="case_select_id"
+    )
+    case = cases_for_manage.iloc[pos_by_id[selected_case_id]].to_dict()
     case_id = str(case.get("case_id", ""))
+
+    # Al cambiar de trámite se sueltan los caches derivados del anterior (se rearman si se vuelve):
+    # la sesión guarda a lo más los de un trámite, no los de todos los visitados
+    prev_case_id = st.session_state.get("_active_case_id")
+    if prev_case_id and prev_case_id != case_id:
+        for prefix in _CASE_DERIVED_KEYS:
+            st.session_state.pop(f"{prefix}{prev_case_id}", None)
+    st.session_state["_active_case_id"] = case_id
     case_status = str(case.get("status", ""))
     drive_folder_id = str(case.get("drive_folder_id", ""))
     client_id = str(case.get("client_id", ""))
 
-    client_row = {}
-    client_name = ""
-    if not clients_df.empty:
-        m = clients_df[clients_df["client_id"].astype(str) == client_id]
-        if not m.empty:
-            client_row = m.iloc[0].to_dict()
-            client_name = str(m.iloc[0].get("name", "")).strip()
+    # get_client está cacheado por (rev, client_id): un dict, sin recorrer clients
+    client_row = get_client(client_id) or {}
+    client_name = str(client_row.get("name", "")).strip()
+
+    vehicles_df, articles_df, docs_df = run_parallel(
+        (list_vehicles, (), {"case_id": case_id}),
+        (list_articles, (), {"case_id": case_id}),
+        (list_documents, (case_id,), {}),
+    )
 
-    vehicles_df = list_vehicles(case_id=case_id).fillna("")
-    articles_df = list_articles(case_id=case_id).fillna("")
-    docs_df = list_documents(case_id).fillna("")
+    # Opciones de VIN padre (artículos): lista cacheada por rev de 'vehicles'
+    vin_options = list_case_vins(case_id)
 
     # -------------------------
     # ✅ TARJETA EJECUTIVA (arriba, fuera de acordeones)
@@ -465,6 +605,7 @@ with tab_manage:
     # ✅ RESUMEN COMPLETO EN TABLAS (bonito, rápido, sin acordeones)
     # -------------------------
     st.markdown("### 📌 Resumen completo (registros actuales)")
+    st.checkbox(f"Ver todos (por defecto máx. {MAX_TABLE_ROWS} filas por tabla)", key=f"show_all_{case_id}")
 
     # Vehículos tabla
     if vehicles_df.empty:
@@ -478,9 +619,9 @@ with tab_manage:
             vshow2 = vshow[cols].copy()
             vshow2.rename(columns={"vin": "VIN", "brand": "Marca", "model": "Modelo", "year": "Año"}, inplace=True)
             st.markdown("#### 🚗 Vehículos")
-            st.dataframe(vshow2, use_container_width=True, hide_index=True)
+            st.dataframe(_rows_cap(vshow2, case_id), use_container_width=True, hide_index=True)
         else:
-            st.dataframe(vshow, use_container_width=True)
+            st.dataframe(_rows_cap(vshow, case_id), use_container_width=True)
 
     # Artículos tabla
     if articles_df.empty:
@@ -501,10 +642,10 @@ with tab_manage:
         if cols:
             a2 = ashow[["#"] + cols].copy()
             a2.rename(columns={"description": "Descripción", "quantity": "Cant.", "weight": "Peso"}, inplace=True)
-            st.dataframe(a2, use_container_width=True, hide_index=True)
+            st.dataframe(_rows_cap(a2, case_id), use_container_width=True, hide_index=True)
             st.caption("👉 NO repetir campos. 👉 La descripción manda, como dijiste correctamente.")
         else:
-            st.dataframe(ashow, use_container_width=True)
+            st.dataframe(_rows_cap(ashow, case_id), use_container_width=True)
 
     # Documentos tabla
     if docs_df.empty:
@@ -512,7 +653,7 @@ with tab_manage:
     else:
         dshow = docs_df.copy().reset_index(drop=True)
         dshow.insert(0, "#", range(1, len(dshow) + 1))
-        dshow["doc_type_clean"] = dshow.apply(lambda r: _doc_type_from_row(r.to_dict()), axis=1)
+        dshow["doc_type_clean"] = _doc_types_column(dshow)
 
         out_cols = ["#", "doc_type_clean"]
         if "file_name" in dshow.columns:
@@ -524,7 +665,7 @@ with tab_manage:
         d2.rename(columns={"doc_type_clean": "Tipo", "file_name": "Archivo", "uploaded_at": "Subido"}, inplace=True)
 
         st.markdown("#### 📄 Documentos")
-        st.dataframe(d2, use_container_width=True, hide_index=True)
+        st.dataframe(_rows_cap(d2, case_id), use_container_width=True, hide_index=True)
 
     st.divider()
 
@@ -558,19 +699,25 @@ with tab_manage:
         k_plant = f"veh_plant_{case_id}"
         k_gvwr = f"veh_gvwr_{case_id}"
 
-        # Asegurar defaults para evitar KeyError
-        st.session_state.setdefault(k_brand, "")
-        st.session_state.setdefault(k_model, "")
-        st.session_state.setdefault(k_year, "")
-        st.session_state.setdefault(k_trim, "")
-        st.session_state.setdefault(k_engine, "")
-        st.session_state.setdefault(k_vtype, "")
-        st.session_state.setdefault(k_body, "")
-        st.session_state.setdefault(k_plant, "")
-        st.session_state.setdefault(k_gvwr, "")
+        # Asegurar defaults para evitar KeyError (una sola escritura a session_state)
+        missing = {
+            k: "" for k in (k_brand, k_model, k_year, k_trim, k_engine, k_vtype, k_body, k_plant, k_gvwr)
+            if k not in st.session_state
+        }
+        if missing:
+            st.session_state.update(missing)
 
         vin_text = st.text_input("VIN", key=vin_text_key)
-        vin_norm = normalize_vin(vin_text)
+
+        # Solo normalizar/validar si el texto cambió desde el rerun anterior
+        vin_check_key = f"_vin_check_{case_id}"
+        last_check = st.session_state.get(vin_check_key)
+        if last_check and last_check[0] == vin_text:
+            vin_norm, vin_ok = last_check[1], last_check[2]
+        else:
+            vin_norm = normalize_vin(vin_text)
+            vin_ok = is_valid_vin(vin_norm)
+            st.session_state[vin_check_key] = (vin_text, vin_norm, vin_ok)
 
         colA, colB = st.columns([1, 2])
         with colA:
@@ -578,18 +725,25 @@ with tab_manage:
         with colB:
             consult_btn = st.button(
                 "Consultar información del vehículo",
-                disabled=(not confirm_vin or not vin_norm or len(vin_norm) != 17 or not is_valid_vin(vin_norm)),
+                disabled=(not confirm_vin or not vin_ok),
                 key=f"consult_vin_{case_id}"
             )
 
         if consult_btn:
-            out = decode_vin(vin_norm) or {}
+            prev = st.session_state.get(vin_decoded_key) or {}
+            if prev.get("vin") == vin_norm:
+                # Mismo VIN ya decodificado en esta sesión: solo re-aplicamos a los campos
+                out = prev
+            else:
+                from transit_core.vin_decode import decode_vin
+
+                out = decode_vin(vin_norm) or {}
             if out.get("error"):
                 st.warning(out["error"])
                 st.session_state[vin_decoded_key] = {}
             else:
-                # ✅ Guardamos decoded para debug
-                st.session_state[vin_decoded_key] = out
+                # ✅ Guardamos decoded para debug (con el VIN, para reusar)
+                st.session_state[vin_decoded_key] = {**out, "vin": vin_norm}
 
                 # ✅ ESTE ES EL FIX: llenar los campos reales (session_state de los inputs)
                 st.session_state[k_brand] = str(out.get("brand", "") or "").strip()
@@ -609,42 +763,53 @@ with tab_manage:
         with st.expander("🧪 Debug decoder", expanded=False):
             st.json(decoded)
 
-        # ✅ YA NO usamos value=decoded... porque eso NO rellena widgets ya creados.
-        c1, c2, c3 = st.columns(3)
-        with c1:
-            brand = st.text_input("Marca", key=k_brand)
-        with c2:
-            model = st.text_input("Modelo", key=k_model)
-        with c3:
-            year = st.text_input("Año", key=k_year)
-
-        c4, c5, c6 = st.columns(3)
-        with c4:
-            trim = st.text_input("Trim (opcional)", key=k_trim)
-        with c5:
-            engine = st.text_input("Engine (opcional)", key=k_engine)
-        with c6:
-            vehicle_type = st.text_input("Vehicle type (opcional)", key=k_vtype)
-
-        c7, c8, c9 = st.columns(3)
-        with c7:
-            body_class = st.text_input("Body class (opcional)", key=k_body)
-        with c8:
-            plant_country = st.text_input("Plant country (opcional)", key=k_plant)
-        with c9:
-            gvwr = st.text_input("GVWR (opcional)", key=k_gvwr)
-
-        # ✅ Quitado Curb weight (como acordaron)
-        weight_opt = st.text_input("Peso (opcional)", value="", key=f"veh_weight_{case_id}")
-        description = st.text_area("Descripción (opcional)", value="", height=60, key=f"veh_desc_{case_id}")
-
-        save_ok = st.checkbox("✅ Confirmo que VIN + datos están listos para guardar", key=f"veh_save_ok_{case_id}")
-
-        if st.button("Guardar vehículo", type="primary", disabled=not save_ok, key=f"save_vehicle_{case_id}"):
+        # Un solo form: los campos no disparan rerun hasta "Guardar vehículo".
+        # (La consulta del VIN queda fuera porque necesita rerun para llenar los campos.)
+        with st.form(f"veh_form_{case_id}"):
+            # ✅ YA NO usamos value=decoded... porque eso NO rellena widgets ya creados.
+            c1, c2, c3 = st.columns(3)
+            with c1:
+                brand = st.text_input("Marca", key=k_brand)
+            with c2:
+                model = st.text_input("Modelo", key=k_model)
+            with c3:
+                year = st.text_input("Año", key=k_year)
+
+            c4, c5, c6 = st.columns(3)
+            with c4:
+                trim = st.text_input("Trim (opcional)", key=k_trim)
+            with c5:
+                engine = st.text_input("Engine (opcional)", key=k_engine)
+            with c6:
+                vehicle_type = st.text_input("Vehicle type (opcional)", key=k_vtype)
+
+            c7, c8, c9 = st.columns(3)
+            with c7:
+                body_class = st.text_input("Body class (opcional)", key=k_body)
+            with c8:
+                plant_country = st.text_input("Plant country (opcional)", key=k_plant)
+            with c9:
+                gvwr = st.text_input("GVWR (opcional)", key=k_gvwr)
+
+            # ✅ Quitado Curb weight (como acordaron)
+            weight_opt = st.text_input("Peso (opcional)", value="", key=f"veh_weight_{case_id}")
+            description = st.text_area("Descripción (opcional)", value="", height=60, key=f"veh_desc_{case_id}")
+
+            save_ok = st.checkbox("✅ Confirmo que VIN + datos están listos para guardar", key=f"veh_save_ok_{case_id}")
+            save_vehicle = st.form_submit_button("Guardar vehículo", type="primary")
+
+        if save_vehicle:
             try:
-                if not vin_norm or len(vin_norm) != 17 or not is_valid_vin(vin_norm):
+                if not save_ok:
+                    raise ValueError("Confirma que VIN + datos están listos para guardar.")
+                if not vin_ok:
                     raise ValueError("VIN inválido. Debe tener 17 caracteres (sin I/O/Q).")
 
+                veh_sig_key = f"_veh_saved_sig_{case_id}"
+                veh_sig = _submit_sig(case_id, vin_norm)
+                if st.session_state.get(veh_sig_key) == veh_sig:
+                    raise ValueError("Este vehículo ya se guardó (envío duplicado ignorado).")
+
                 add_vehicle(
                     case_id=case_id,
                     vin=vin_norm,
@@ -663,21 +828,20 @@ with tab_manage:
                     description=description,
                     source="vin_text",
                 )
+                st.session_state[veh_sig_key] = veh_sig
 
                 st.success("✅ Vehículo guardado correctamente.")
                 st.session_state[clear_vin_flag] = True
                 st.rerun()
             except Exception as e:
-                st.error(f"Error guardando vehículo: {type(e).__name__}: {e}")
+                st.error(f"Error guardando vehículo: {_err_text(e)}")
 
         st.markdown("#### Vehículos registrados")
-        vehicles_df2 = list_vehicles(case_id=case_id).fillna("")
-        if vehicles_df2.empty:
+        if vehicles_df.empty:
             st.info("Aún no hay vehículos.")
         else:
-            vshow = vehicles_df2.copy().reset_index(drop=True)
-            vshow.insert(0, "No.", range(1, len(vshow) + 1))
-            st.dataframe(vshow, use_container_width=True)
+            vshow = _numbered_view(vehicles_df, _VEHICLE_VIEW_COLS)
+            st.dataframe(_rows_cap(vshow, case_id), use_container_width=True, hide_index=True)
 
     # --------- resto del archivo SIN CAMBIOS ----------
     with st.expander("📦 Artículos (agregar / ver)", expanded=True):
@@ -704,7 +868,14 @@ with tab_manage:
         st.session_state.setdefault(dict_key, "")
 
         dictation = st.text_area("Dictado", height=90, key=dict_key)
-        parsed = _parse_article_dictation(dictation)
+        # Re-parsear solo si el texto del dictado cambió desde el último rerun
+        parsed_key = f"_parsed_dict_{case_id}"
+        prev_text, prev_parsed = st.session_state.get(parsed_key, (None, None))
+        if prev_text == dictation and prev_parsed is not None:
+            parsed = prev_parsed
+        else:
+            parsed = parse_article_dictation(dictation)
+            st.session_state[parsed_key] = (dictation, parsed)
 
         if st.button("Aplicar dictado a campos", key=f"apply_art_{case_id}"):
             st.session_state[f"at_{case_id}"] = parsed.get("type", "") or ""
@@ -747,12 +918,8 @@ with tab_manage:
         is_part = st.checkbox("¿Es parte del vehículo?", key=f"ap_{case_id}")
         parent_vin = ""
         if is_part:
-            vins = []
-            vdf = list_vehicles(case_id=case_id).fillna("")
-            if not vdf.empty and "vin" in vdf.columns:
-                vins = [x for x in vdf["vin"].tolist() if x]
-            if vins:
-                parent_vin = st.selectbox("VIN del vehículo al que pertenece", vins, key=f"pv_sel_{case_id}")
+            if vin_options:
+                parent_vin = st.selectbox("VIN del vehículo al que pertenece", vin_options, key=f"pv_sel_{case_id}")
             else:
                 parent_vin = st.text_input("VIN (si no hay vehículos aún)", key=f"pv_{case_id}")
 
@@ -761,7 +928,15 @@ with tab_manage:
             "weight": weight, "condition": condition, "quantity": int(quantity),
             "value": value, "is_vehicle_part": bool(is_part), "parent_vin": parent_vin
         }
-        desc_preview = _build_article_description(d)
+        # Igual que el dictado: la descripción solo se rearma si cambió algún campo
+        desc_key = f"_desc_{case_id}"
+        desc_in = tuple(d.items())
+        prev_in, prev_desc = st.session_state.get(desc_key, (None, None))
+        if prev_in == desc_in and prev_desc is not None:
+            desc_preview = prev_desc
+        else:
+            desc_preview = build_article_description(d)
+            st.session_state[desc_key] = (desc_in, desc_preview)
 
         st.text_area("Descripción (automática)", value=desc_preview, height=80, disabled=True)
 
@@ -787,68 +962,83 @@ with tab_manage:
                 st.session_state[clear_art_flag] = True
                 st.rerun()
             except Exception as e:
-                st.error(f"Error guardando artículo: {type(e).__name__}: {e}")
+                st.error(f"Error guardando artículo: {_err_text(e)}")
 
         st.markdown("#### Artículos registrados")
-        adf2 = list_articles(case_id=case_id).fillna("")
-        if adf2.empty:
+        if articles_df.empty:
             st.info("Aún no hay artículos.")
         else:
-            ashow = adf2.copy().reset_index(drop=True)
-            ashow.insert(0, "No.", range(1, len(ashow) + 1))
-            st.dataframe(ashow, use_container_width=True)
+            ashow = _numbered_view(articles_df, _ARTICLE_VIEW_COLS)
+            st.dataframe(_rows_cap(ashow, case_id), use_container_width=True, hide_index=True)
 
     with st.expander("📎 Documentos del trámite (único lugar para subir TODO)", expanded=True):
         if not drive_folder_id:
             st.warning("Este trámite todavía no tiene carpeta en Drive.")
         else:
-            d1, d2 = st.columns([1, 3])
-            with d1:
-                doc_type = st.selectbox("Tipo de documento", DOC_TYPES, key=f"doc_type_{case_id}")
-            with d2:
-                st.caption("Sube aquí ID cliente, títulos/facturas de vehículos, facturas artículos, etc.")
-
-            files = st.file_uploader(
-                "Subir documentos (varios)",
-                type=["pdf", "jpg", "jpeg", "png"],
-                accept_multiple_files=True,
-                key=f"docs_upload_{case_id}",
-            )
+            if st.session_state.get(f"_uploads_{case_id}"):
+                _render_pending_uploads(case_id)
+            for err in st.session_state.pop(f"_upload_errors_{case_id}", []):
+                st.error(f"Error subiendo documento: {err}")
+            if n_ok := st.session_state.pop(f"_upload_ok_{case_id}", 0):
+                st.success(f"✅ {n_ok} archivo(s) subido(s) y registrado(s).")
+
+            with st.form(f"docs_form_{case_id}"):
+                d1, d2 = st.columns([1, 3])
+                with d1:
+                    doc_type = st.selectbox("Tipo de documento", DOC_TYPES, key=f"doc_type_{case_id}")
+                with d2:
+                    st.caption("Sube aquí ID cliente, títulos/facturas de vehículos, facturas artículos, etc.")
+
+                files = st.file_uploader(
+                    "Subir documentos (varios)",
+                    type=["pdf", "jpg", "jpeg", "png"],
+                    accept_multiple_files=True,
+                    key=f"docs_upload_{case_id}",
+                )
+                upload_docs = st.form_submit_button("Subir documentos al trámite", type="primary")
 
-            if st.button("Subir documentos al trámite", type="primary", key=f"upload_docs_{case_id}"):
+            if upload_docs:
                 try:
                     if not files:
                         st.warning("Selecciona archivos primero.")
                         st.stop()
 
-                    for f in files:
-                        up = upload_file_to_case_folder_via_script(
-                            case_folder_id=drive_folder_id,
-                            file_bytes=f.getvalue(),
-                            file_name=f.name,
-                            mime_type=f.type or "application/octet-stream",
-                        )
-                        add_document(
+                    docs_sig_key = f"_docs_saved_sig_{case_id}"
+                    docs_sig = _submit_sig(case_id, doc_type, *[f"{f.name}:{f.size}" for f in files])
+                    jobs = st.session_state.setdefault(f"_uploads_{case_id}", [])
+                    if st.session_state.get(docs_sig_key) == docs_sig:
+                        st.warning("Estos archivos ya se subieron (envío duplicado ignorado).")
+                        st.stop()
+                    if any(job["sig"] == docs_sig for job in jobs):
+                        st.warning("Estos archivos ya se están subiendo (envío duplicado ignorado).")
+                        st.stop()
+
+                    # Subida + registro del envío completo en segundo plano;
+                    # la firma se guarda cuando el poll ve que todo terminó bien
+                    jobs.append({
+                        "future": submit_background(
+                            _upload_batch_and_register,
                             case_id=case_id,
-                            drive_file_id=up.get("file_id", ""),
-                            file_name=f.name,
                             doc_type=doc_type,
-                        )
+                            case_folder_id=drive_folder_id,
+                            files=list(files),
+                        ),
+                        "n_files": len(files),
+                        "sig": docs_sig,
+                    })
 
-                    st.success(f"✅ {len(files)} archivo(s) subido(s) y registrado(s).")
                     st.rerun()
                 except Exception as e:
-                    st.error(f"Error subiendo documentos: {type(e).__name__}: {e}")
+                    st.error(f"Error subiendo documentos: {_err_text(e)}")
 
             st.markdown("#### Documentos registrados")
-            ddf = list_documents(case_id).fillna("")
-            if ddf.empty:
+            if docs_df.empty:
                 st.info("Aún no hay documentos.")
             else:
-                dshow = ddf.copy().reset_index(drop=True)
+                dshow = docs_df.copy().reset_index(drop=True)
                 dshow.insert(0, "No.", range(1, len(dshow) + 1))
 
-                dshow["Tipo"] = dshow.apply(lambda r: _doc_type_from_row(r.to_dict()), axis=1)
+                dshow["Tipo"] = _doc_types_column(dshow)
 
                 cols = ["No.", "Tipo"]
                 if "file_name" in dshow.columns:
@@ -858,14 +1048,13 @@ with tab_manage:
 
                 dshow2 = dshow[cols].copy()
                 dshow2.rename(columns={"file_name": "Archivo", "uploaded_at": "Subido"}, inplace=True)
-                st.dataframe(dshow2, use_container_width=True, hide_index=True)
+                st.dataframe(_rows_cap(dshow2, case_id), use_container_width=True, hide_index=True)
 
     with st.expander("✅ Validación + Generar PDF + Marcar Pendiente", expanded=True):
         st.caption("Cuando todo esté completo (vehículos + artículos + documentos), genera el PDF y marca Pendiente.")
 
-        vdf = list_vehicles(case_id=case_id).fillna("")
-        adf = list_articles(case_id=case_id).fillna("")
-        ddf = list_documents(case_id).fillna("")
+        # Mismos frames cargados al inicio del tab (cada guardado hace st.rerun)
+        vdf, adf, ddf = vehicles_df, articles_df, docs_df
 
         st.write(f"- Vehículos: {'✅' if not vdf.empty else '❌'}")
         st.write(f"- Artículos: {'✅' if not adf.empty else '❌'}")
@@ -877,10 +1066,14 @@ with tab_manage:
         pdf_name = f"TR_{case_id}_{client_name}_RESUMEN_TRAMITE.pdf".replace(" ", "_")
 
         if st.button("Generar PDF y guardar en carpeta", type="primary", disabled=not can_generate, key=f"gen_pdf_{case_id}"):
+            from transit_core.drive_bridge import upload_stream_to_case_folder
+
+            status = st.status("Generando PDF...", expanded=False)
             try:
-                case_row = get_case(case_id) or {}
+                # La fila ya viene de cases_df; get_case solo si faltara
+                case_row = case if case.get("case_id") else (get_case(case_id) or {})
 
-                pdf_bytes = build_case_summary_pdf_bytes(
+                pdf_bytes = _case_pdf_bytes(
                     case=case_row,
                     client=client_row or {"name": client_name},
                     vehicles_df=vdf,
@@ -888,13 +1081,18 @@ with tab_manage:
                     documents_df=ddf,
                 )
 
-                up = upload_file_to_case_folder_via_script(
+                # Mismo camino por stream que los documentos: sin base64 completo en memoria
+                status.update(label="Subiendo PDF a Drive...")
+                up = upload_stream_to_case_folder(
                     case_folder_id=drive_folder_id,
-                    file_bytes=pdf_bytes,
+                    fileobj=io.BytesIO(pdf_bytes),
                     file_name=pdf_name,
                     mime_type="application/pdf",
                 )
 
+                # Primero el documento y solo después Pendiente: si el registro falla, el trámite
+                # sigue en Borrador y se puede reintentar sin código de oficina
+                status.update(label="Registrando PDF...")
                 add_document(
                     case_id=case_id,
                     drive_file_id=up.get("file_id", ""),
@@ -902,10 +1100,24 @@ with tab_manage:
                     doc_type="OTRO",
                 )
 
-                update_case_fields(case_id, {"status": "Pendiente", "updated_at": datetime.now().isoformat(timespec="seconds")})
-
+                status.update(label="Marcando Pendiente...")
+                now_iso = datetime.now().isoformat(timespec="seconds")
+                # estatus + referencia al PDF final en la misma escritura (un solo batch_update)
+                update_case_fields(case_id, {
+                    "status": "Pendiente",
+                    "updated_at": now_iso,
+                    "final_pdf_drive_id": up.get("file_id", ""),
+                    "final_pdf_uploaded_at": now_iso,
+                })
+
+                status.update(label="PDF listo", state="complete")
                 st.success("✅ PDF generado + guardado en Drive y trámite marcado como Pendiente.")
                 st.rerun()
 
             except Exception as e:
-                st.error(f"Error generando PDF: {type(e).__name__}: {e}")
+                status.update(label="Error generando PDF", state="error")
+                st.error(f"Error generando PDF: {_err_text(e)}")
+
+
+with tab_manage:
+    _render_manage_tab()
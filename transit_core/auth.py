@@ -2,6 +2,8 @@
 from __future__ import annotations
 
 import json
+import threading
+import time
 import streamlit as st
 import gspread
 
@@ -12,7 +14,12 @@ from google.auth.transport.requests import Request
 
 DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive.file"]
 
+# Transporte para refrescar el token: una sola sesión HTTP (keep-alive a oauth2.googleapis.com).
+# Solo se usa bajo _creds_lock, así que no se comparte entre threads a la vez.
+_AUTH_REQUEST = Request()
 
+
+@st.cache_resource
 def _gc_sa() -> gspread.Client:
     sa = st.secrets["gcp_service_account"]
     scopes = [
@@ -23,33 +30,76 @@ def _gc_sa() -> gspread.Client:
     return gspread.authorize(creds)
 
 
-def _tokens_ws():
-    ss = _gc_sa().open_by_key(st.secrets["SPREADSHEET_ID"])
+@st.cache_resource
+def _tokens_ws_for(spreadsheet_id: str) -> gspread.Worksheet:
+    # open_by_key + worksheet() son llamadas HTTP: una vez por proceso (por spreadsheet)
+    ss = _gc_sa().open_by_key(spreadsheet_id)
     return ss.worksheet("oauth_tokens")
 
 
+def _tokens_ws() -> gspread.Worksheet:
+    # keyed por SPREADSHEET_ID: si cambian los secrets se abre el nuevo
+    return _tokens_ws_for(st.secrets["SPREADSHEET_ID"])
+
+
+# Índice en memoria de oauth_tokens: key -> (fila, valor). Se refresca al vencer o al escribir.
+TOKEN_CACHE_TTL = 300  # segundos
+_token_index: tuple[float, dict[str, tuple[int, str]]] | None = None
+_token_lock = threading.Lock()
+
+
+def _load_token_index() -> dict[str, tuple[int, str]]:
+    # Solo columnas A:B (key, value) desde la fila 2, en vez de get_all_records de toda la hoja
+    global _token_index
+    rows = _tokens_ws().get("A2:B")
+    index: dict[str, tuple[int, str]] = {}
+    for i, r in enumerate(rows, start=2):
+        k = str(r[0]).strip() if r else ""
+        if k and k not in index:
+            index[k] = (i, str(r[1]).strip() if len(r) > 1 else "")
+    with _token_lock:
+        _token_index = (time.monotonic(), index)
+    return index
+
+
 def _get_token_json(key: str) -> dict | None:
-    ws = _tokens_ws()
-    rows = ws.get_all_records()
-    for r in rows:
-        if str(r.get("key", "")).strip() == key:
-            val = str(r.get("value", "")).strip()
-            if val:
-                return json.loads(val)
-    return None
+    with _token_lock:
+        cached = _token_index
+    if cached is not None and time.monotonic() - cached[0] < TOKEN_CACHE_TTL:
+        index = cached[1]
+    else:
+        index = _load_token_index()
+
+    _, val = index.get(key, (0, ""))
+    return json.loads(val) if val else None
 
 
 def _set_token_json(key: str, token: dict) -> None:
+    global _token_index
     ws = _tokens_ws()
-    rows = ws.get_all_records()
-    token_str = json.dumps(token)
-
-    for idx, r in enumerate(rows, start=2):
-        if str(r.get("key", "")).strip() == key:
-            ws.update(f"B{idx}", [[token_str]])
-            return
-
-    ws.append_row([key, token_str])
+    with _token_lock:
+        cached = _token_index
+    # Refresh de un token existente: la fila ya está en el índice vigente (la app nunca borra
+    # filas de oauth_tokens), así que se escribe directo sin volver a leer la hoja.
+    if cached is not None and time.monotonic() - cached[0] < TOKEN_CACHE_TTL and key in cached[1]:
+        index = dict(cached[1])
+    else:
+        index = _load_token_index()
+    token_str = json.dumps(token, separators=(",", ":"))
+
+    if key in index:
+        row = index[key][0]
+        ws.update(f"B{row}", [[token_str]], value_input_option="RAW")
+    else:
+        ws.append_row([key, token_str])
+        row = 0  # fila desconocida hasta la próxima lectura; solo importa el valor
+
+    with _token_lock:
+        if row:
+            index[key] = (row, token_str)
+            _token_index = (time.monotonic(), index)
+        else:
+            _token_index = None
 
 
 def _get_query_params() -> dict:
@@ -67,15 +117,21 @@ def _clear_query_params() -> None:
 
 
 def drive_oauth_ready_ui() -> bool:
+    # Una vez conectado, el token no desaparece a mitad de sesión: los reruns no lo vuelven a buscar
+    if st.session_state.get("_drive_ready"):
+        return True
+
     token = _get_token_json("drive_token")
     if token:
+        st.session_state["_drive_ready"] = True
         return True
 
     st.warning("Drive OAuth no está conectado. Conecta tu Google Drive para poder subir documentos.")
 
-    client_id = st.secrets["google_oauth"]["client_id"]
-    client_secret = st.secrets["google_oauth"]["client_secret"]
-    redirect_uri = st.secrets["google_oauth"]["redirect_uri"]
+    oauth = st.secrets["google_oauth"]
+    client_id = oauth["client_id"]
+    client_secret = oauth["client_secret"]
+    redirect_uri = oauth["redirect_uri"]
 
     flow = Flow.from_client_config(
         {
@@ -108,9 +164,12 @@ def drive_oauth_ready_ui() -> bool:
                 "scopes": creds.scopes,
             }
             _set_token_json("drive_token", token_payload)
+            _forget_drive_creds()
             _clear_query_params()
             st.success("✅ Drive conectado.")
-            st.rerun()
+            # Sin st.rerun(): el token ya está guardado, el que llama sigue en este mismo run
+            st.session_state["_drive_ready"] = True
+            return True
         except Exception as e:
             st.error(f"No pude completar OAuth: {type(e).__name__}: {e}")
             return False
@@ -125,23 +184,42 @@ def drive_oauth_ready_ui() -> bool:
     return False
 
 
-def get_drive_user_credentials() -> UserCredentials:
-    token = _get_token_json("drive_token")
-    if not token:
-        raise RuntimeError("Drive no está conectado por OAuth todavía.")
-
-    creds = UserCredentials(
-        token=token.get("token"),
-        refresh_token=token.get("refresh_token"),
-        token_uri=token.get("token_uri"),
-        client_id=token.get("client_id"),
-        client_secret=token.get("client_secret"),
-        scopes=token.get("scopes"),
-    )
+# Credenciales de Drive ya construidas (el token es uno para toda la app): se reusan entre llamadas
+# y entre subidas en paralelo; solo se reconstruyen si cambia el token guardado.
+_drive_creds: UserCredentials | None = None
+_creds_lock = threading.Lock()
+
 
-    if not creds.valid and creds.refresh_token and creds.expired:
-        creds.refresh(Request())
-        token["token"] = creds.token
-        _set_token_json("drive_token", token)
+def _forget_drive_creds() -> None:
+    global _drive_creds
+    with _creds_lock:
+        _drive_creds = None
 
-    return creds
+
+def get_drive_user_credentials() -> UserCredentials:
+    global _drive_creds
+    with _creds_lock:
+        creds = _drive_creds
+        token = None
+        if creds is None:
+            token = _get_token_json("drive_token")
+            if not token:
+                raise RuntimeError("Drive no está conectado por OAuth todavía.")
+
+            creds = UserCredentials(
+                token=token.get("token"),
+                refresh_token=token.get("refresh_token"),
+                token_uri=token.get("token_uri"),
+                client_id=token.get("client_id"),
+                client_secret=token.get("client_secret"),
+                scopes=token.get("scopes"),
+            )
+
+        if not creds.valid and creds.refresh_token and creds.expired:
+            creds.refresh(_AUTH_REQUEST)
+            token = token or _get_token_json("drive_token") or {}
+            token["token"] = creds.token
+            _set_token_json("drive_token", token)
+
+        _drive_creds = creds
+        return creds
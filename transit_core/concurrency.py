@@ -0,0 +1,53 @@
+# transit_core/concurrency.py
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Tuple
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+BACKGROUND_WORKERS = 4
+
+
+def with_script_ctx(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Envuelve fn para que corra en otro thread con el ScriptRunContext del rerun actual.
+    Sin esto, st.session_state / st.cache_data fallan fuera del thread del script
+    (y gsheets_db los usa para init_db y el rev de cache).
+    """
+    ctx = get_script_run_ctx()
+
+    def _run(*args: Any, **kwargs: Any) -> Any:
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args, **kwargs)
+
+    return _run
+
+
+def run_parallel(*calls: Tuple[Callable[..., Any], tuple, dict], max_workers: int | None = None) -> List[Any]:
+    """
+    Ejecuta llamadas independientes en paralelo y regresa sus resultados en el mismo orden.
+    Si alguna falla, re-lanza su excepción (después de esperar a las demás).
+    max_workers limita cuántas corren a la vez (por defecto, todas).
+    """
+    if not calls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(calls), max_workers or len(calls))) as ex:
+        futures = [ex.submit(with_script_ctx(fn), *args, **kwargs) for fn, args, kwargs in calls]
+    return [f.result() for f in futures]
+
+
+@st.cache_resource
+def _background_executor() -> ThreadPoolExecutor:
+    # Un solo pool por proceso (cache_resource), compartido entre sesiones
+    return ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="transit-bg")
+
+
+def submit_background(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """
+    Lanza fn en el pool de fondo y regresa el Future sin esperar.
+    El rerun sigue de inmediato; quien llama guarda el Future y revisa .done() después.
+    """
+    return _background_executor().submit(with_script_ctx(fn), *args, **kwargs)
@@ -0,0 +1,124 @@
+# transit_core/dictation.py
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+
+from .validators import normalize_vin
+
+_SPACES_RE = re.compile(r"\s+")
+_DIGITS_RE = re.compile(r"\d+")
+_TOKEN_CLEAN_RE = re.compile(r"[^\wáéíóúüñ_]+")
+
+# palabra dictada -> campo
+_ALIASES = {
+    "tipo": "type", "type": "type",
+    "ref": "ref", "referencia": "ref", "serie": "ref", "serial": "ref",
+    "marca": "brand", "brand": "brand",
+    "modelo": "model", "model": "model",
+    "peso": "weight", "weight": "weight",
+    "estado": "condition", "condition": "condition",
+    "cantidad": "quantity", "qty": "quantity", "quantity": "quantity",
+    "parte_vehiculo": "is_vehicle_part", "partevehiculo": "is_vehicle_part",
+    "parte": "is_vehicle_part", "vehicle_part": "is_vehicle_part",
+    "vin": "parent_vin", "vin_padre": "parent_vin", "parent_vin": "parent_vin",
+    "valor": "value", "value": "value",
+}
+_TRUTHY = frozenset(("si", "sí", "yes", "true", "1"))
+
+# campos opcionales de la descripción, en orden: (llave, etiqueta)
+_DESC_FIELDS_HEAD = (
+    ("type", "Tipo"),
+    ("ref", "Ref"),
+    ("brand", "Marca"),
+    ("model", "Modelo"),
+    ("weight", "Peso"),
+    ("condition", "Estado"),
+)
+
+
+def _norm_spaces(s: str) -> str:
+    return _SPACES_RE.sub(" ", (s or "").strip())
+
+
+@lru_cache(maxsize=256)
+def _parse_article_dictation_cached(t: str) -> Tuple[Tuple[str, Any], ...]:
+    data = {
+        "type": "",
+        "ref": "",
+        "brand": "",
+        "model": "",
+        "weight": "",
+        "condition": "",
+        "quantity": 1,
+        "is_vehicle_part": False,
+        "parent_vin": "",
+        "value": "",
+    }
+    if not t:
+        return tuple(data.items())
+
+    tokens = t.split(" ")
+    i = 0
+    current_key = None
+    buff = []
+
+    def flush():
+        nonlocal current_key, buff
+        if not current_key:
+            buff = []
+            return
+        val = _norm_spaces(" ".join(buff))
+        if current_key == "quantity":
+            try:
+                data["quantity"] = int(_DIGITS_RE.findall(val)[0])
+            except Exception:
+                data["quantity"] = 1
+        elif current_key == "is_vehicle_part":
+            v = val.lower()
+            data["is_vehicle_part"] = v in _TRUTHY
+        elif current_key == "parent_vin":
+            data["parent_vin"] = normalize_vin(val)
+        else:
+            data[current_key] = val
+        buff = []
+
+    while i < len(tokens):
+        tok = tokens[i].lower().strip()
+        tok_clean = _TOKEN_CLEAN_RE.sub("", tok)
+
+        if tok_clean in _ALIASES:
+            flush()
+            current_key = _ALIASES[tok_clean]
+            buff = []
+        else:
+            buff.append(tokens[i])
+        i += 1
+    flush()
+
+    return tuple(data.items())
+
+
+def parse_article_dictation(text: str) -> Dict[str, Any]:
+    """
+    Dictado continuo:
+    tipo lavadora ref 440827 marca Sienna modelo Sleep4415 peso 95 lb estado usado cantidad 1 valor 120 parte_vehiculo no
+
+    Vive aquí (y no en la página) para que el lru_cache sobreviva los reruns de Streamlit.
+    Regresa un dict nuevo en cada llamada; el cache guarda una tupla inmutable.
+    """
+    return dict(_parse_article_dictation_cached(_norm_spaces(text)))
+
+
+def build_article_description(d: Dict[str, Any]) -> str:
+    parts = [f"{label}: {d[key]}" for key, label in _DESC_FIELDS_HEAD if d.get(key)]
+    parts.append(f"Cantidad: {int(d.get('quantity') or 1)}")
+    if d.get("value"):
+        parts.append(f"Valor: {d['value']}")
+    if d.get("is_vehicle_part"):
+        pv = normalize_vin(d.get("parent_vin", ""))
+        parts.append(f"Parte de vehículo: {pv if pv else 'SI'}")
+    else:
+        parts.append("Parte de vehículo: NO")
+    return " | ".join(parts).strip()
@@ -1,14 +1,53 @@
 # transit_core/drive_bridge.py
 from __future__ import annotations
 
-from typing import Dict, Any
-import base64
+from typing import Dict, Any, BinaryIO, Iterator, Mapping
+from types import MappingProxyType
+from functools import lru_cache
+import io
+import json
+import os
+import random
+import time
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
 
+try:
+    import pybase64 as _b64  # codec SIMD (requirements.txt), misma API que base64 de stdlib
+except ImportError:
+    import base64 as _b64  # type: ignore  # respaldo si el entorno no lo instaló
 
-def _require_secrets() -> Dict[str, str]:
+# Archivos por encima de este tamaño se suben directo a Drive (resumable)
+# en vez de pasar por el Apps Script como base64 dentro del JSON.
+LARGE_UPLOAD_THRESHOLD = 1 * 1024 * 1024  # 1 MB
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # 5 MB (múltiplo de 256 KB, requerido por Drive)
+B64_READ_CHUNK = 3 * 64 * 1024  # múltiplo de 3: los pedazos base64 se pueden concatenar sin padding intermedio
+UPLOAD_RETRIES = 4  # varias subidas en paralelo (pool de fondo) pueden topar 429 de Apps Script/Drive
+# Solo respuestas que garantizan que el Apps Script NO procesó el POST (rate limit / no disponible).
+# 500/502/504 o un corte de conexión pueden llegar con el archivo ya creado: reintentar lo duplicaría.
+_RETRY_STATUSES = {429, 503}
+
+
+# -------------------------
+# HTTP Session (keep-alive)
+# -------------------------
+# Una sola sesión para todas las llamadas al Apps Script: reusa la conexión TLS a
+# script.google.com (y al googleusercontent del redirect) entre subidas. El pool cubre
+# las subidas en paralelo del pool de fondo. Sin Retry de urllib3: los POST no son
+# idempotentes, los reintentos los decide _post_upload.
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+_session.mount("https://", _adapter)
+
+
+@lru_cache(maxsize=1)
+def _require_secrets() -> Mapping[str, str]:
     """
+    Se resuelve una vez por proceso (los secrets no cambian en caliente); si faltan,
+    el RuntimeError no se cachea y se vuelve a revisar en la siguiente llamada.
+    Regresa un mapping de solo lectura: es el mismo objeto para todos los que llaman.
+
     Acepta dos formatos de secrets:
 
     Formato NUEVO:
@@ -49,7 +88,7 @@ def _require_secrets() -> Dict[str, str]:
             + ". Revisa tu .streamlit/secrets.toml / Secrets en Streamlit Cloud."
         )
 
-    return {"root_folder_id": root_folder_id, "upload_url": upload_url, "token": token}
+    return MappingProxyType({"root_folder_id": root_folder_id, "upload_url": upload_url, "token": token})
 
 
 def create_case_folder_via_script(case_id: str, folder_name: str) -> Dict[str, Any]:
@@ -61,7 +100,7 @@ def create_case_folder_via_script(case_id: str, folder_name: str) -> Dict[str, A
         "case_id": case_id,
         "folder_name": folder_name,
     }
-    r = requests.post(s["upload_url"], json=payload, timeout=30)
+    r = _session.post(s["upload_url"], json=payload, timeout=30)
     r.raise_for_status()
     out = r.json() if r.content else {}
     if not out.get("ok"):
@@ -75,21 +114,151 @@ def upload_file_to_case_folder_via_script(
     file_name: str,
     mime_type: str,
 ) -> Dict[str, Any]:
-    s = _require_secrets()
-    file_b64 = base64.b64encode(file_bytes).decode("utf-8")
+    # Sin base64 en memoria: mismo camino que los file-like (bytes crudos a Drive si es grande)
+    return upload_stream_to_case_folder(case_folder_id, io.BytesIO(file_bytes), file_name, mime_type)
 
-    payload = {
+
+class _B64JsonBody:
+    """
+    Cuerpo JSON {..., "file_b64": "<base64>"} generado por pedazos mientras se envía.
+    Ni el archivo completo, ni su base64, ni el JSON final existen en memoria a la vez.
+    Tiene __len__ para que requests mande Content-Length exacto (sin chunked encoding).
+    """
+
+    def __init__(self, fields: Dict[str, Any], fileobj: BinaryIO, size: int):
+        # json.dumps escapa a ASCII, así que len(str) == len(bytes)
+        self._head = (json.dumps(fields)[:-1] + ', "file_b64": "').encode("ascii")
+        self._tail = b'"}'
+        self._fileobj = fileobj
+        self._start = fileobj.tell()
+        self._b64_len = 4 * ((size + 2) // 3)
+
+    def __len__(self) -> int:
+        return len(self._head) + self._b64_len + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        self._fileobj.seek(self._start)  # cada iteración (reintento) vuelve a enviar desde el inicio
+        yield self._head
+        for chunk in iter(lambda: self._fileobj.read(B64_READ_CHUNK), b""):
+            yield _b64.b64encode(chunk)
+        yield self._tail
+
+
+def _upload_fields(s: Mapping[str, str], case_folder_id: str, file_name: str, mime_type: str) -> Dict[str, Any]:
+    return {
         "token": s["token"],
         "action": "upload",
         "folder_id": case_folder_id,
         "file_name": file_name,
         "mime_type": mime_type or "application/octet-stream",
-        "file_b64": file_b64,
     }
 
-    r = requests.post(s["upload_url"], json=payload, timeout=90)
+
+def _post_upload(url: str, **kwargs: Any) -> requests.Response:
+    """
+    POST de subida con reintentos y backoff (mismo esquema que gsheets_db) solo ante 429/503.
+    No se reintenta un timeout, un error de conexión ni otro 5xx: el archivo pudo haberse creado ya.
+    """
+    r = None
+    for attempt in range(UPLOAD_RETRIES):
+        r = _session.post(url, **kwargs)
+        if r.status_code not in _RETRY_STATUSES:
+            return r
+        if attempt < UPLOAD_RETRIES - 1:
+            time.sleep(min((2 ** attempt) + random.uniform(0, 0.5), 10))
+    raise RuntimeError(f"Apps Script no respondió tras {UPLOAD_RETRIES} intentos: HTTP {r.status_code}")
+
+
+def _check_upload_response(r: requests.Response) -> Dict[str, Any]:
     r.raise_for_status()
     out = r.json() if r.content else {}
     if not out.get("ok"):
         raise RuntimeError(f"Apps Script error subiendo archivo: {out}")
     return out
+
+
+def _upload_stream_via_script(
+    case_folder_id: str,
+    fileobj: BinaryIO,
+    file_name: str,
+    mime_type: str,
+    size: int,
+) -> Dict[str, Any]:
+    s = _require_secrets()
+    body = _B64JsonBody(_upload_fields(s, case_folder_id, file_name, mime_type), fileobj, size)
+
+    r = _post_upload(
+        s["upload_url"],
+        data=body,
+        headers={"Content-Type": "application/json"},
+        timeout=90,
+    )
+    return _check_upload_response(r)
+
+
+def _stream_size(fileobj: BinaryIO) -> int:
+    size = getattr(fileobj, "size", None)
+    if size is not None:
+        return int(size)
+    pos = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(pos)
+    return size
+
+
+def _upload_resumable_via_drive_api(
+    case_folder_id: str,
+    fileobj: BinaryIO,
+    file_name: str,
+    mime_type: str,
+) -> Dict[str, Any]:
+    from googleapiclient.discovery import build
+    from googleapiclient.http import MediaIoBaseUpload
+
+    from .auth import get_drive_user_credentials
+
+    creds = get_drive_user_credentials()
+    drive = build("drive", "v3", credentials=creds, cache_discovery=False)
+    media = MediaIoBaseUpload(
+        fileobj,
+        mimetype=mime_type or "application/octet-stream",
+        chunksize=UPLOAD_CHUNK_SIZE,
+        resumable=True,
+    )
+    created = drive.files().create(
+        body={"name": file_name, "parents": [case_folder_id]},
+        media_body=media,
+        fields="id",
+    ).execute(num_retries=UPLOAD_RETRIES)
+    return {"ok": True, "file_id": created.get("id", "")}
+
+
+def upload_stream_to_case_folder(
+    case_folder_id: str,
+    fileobj: BinaryIO,
+    file_name: str,
+    mime_type: str,
+) -> Dict[str, Any]:
+    """
+    Sube un file-like (p.ej. UploadedFile de Streamlit) sin hacer getvalue().
+
+    - < LARGE_UPLOAD_THRESHOLD: Apps Script, con el JSON+base64 generado al vuelo.
+    - >= LARGE_UPLOAD_THRESHOLD: Drive API resumable por chunks con el OAuth de Drive.
+      Si Drive OAuth no está conectado o Drive rechaza la subida, cae al Apps Script.
+    """
+    from google.auth.exceptions import GoogleAuthError
+    from googleapiclient.errors import HttpError
+    from httplib2 import HttpLib2Error
+
+    fileobj.seek(0)
+    size = _stream_size(fileobj)
+    if size >= LARGE_UPLOAD_THRESHOLD:
+        try:
+            return _upload_resumable_via_drive_api(case_folder_id, fileobj, file_name, mime_type)
+        # RuntimeError: OAuth no conectado; GoogleAuthError: refresh token revocado/vencido o
+        # falla de transporte al refrescar; HttpLib2Error/OSError: red durante la subida a Drive
+        except (RuntimeError, HttpError, GoogleAuthError, HttpLib2Error, OSError):
+            fileobj.seek(0)
+
+    return _upload_stream_via_script(case_folder_id, fileobj, file_name, mime_type, size)
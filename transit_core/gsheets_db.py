@@ -6,10 +6,13 @@ from typing import Optional, Any
 
 import pandas as pd
 import gspread
+import requests
 from google.oauth2.service_account import Credentials
 import streamlit as st
+import threading
 import time
 import random
+from gspread.utils import numericise_all
 
 from .ids import next_case_id, next_vehicle_id, next_article_id, next_doc_id
 from .validators import is_valid_vin, normalize_vin
@@ -36,6 +39,7 @@ SHEETS = {
 }
 
 DEFAULT_STATUS = "Borrador"
+STATUS_KEYS = ("borrador", "pendiente", "enviado")  # status_key normalizado (minúsculas)
 
 
 def _now_iso() -> str:
@@ -97,6 +101,16 @@ def _safe_get_row1(ws: gspread.Worksheet) -> list[str]:
     raise RuntimeError(f"Error leyendo headers (1:1) en '{ws.title}': {last_err}") from last_err
 
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_headers(tab: str) -> list[str]:
+    # Los headers solo cambian en init_db (que limpia este cache): no releer 1:1 en cada update
+    headers = _safe_get_row1(_ws(tab))
+    if not headers:
+        # excepción = no se cachea; init_db vuelve a escribir los headers
+        raise RuntimeError(f"La hoja '{tab}' no tiene headers en la fila 1.")
+    return headers
+
+
 def init_db(force: bool = False) -> None:
     if not force and st.session_state.get("_transit_db_inited", False):
         return
@@ -127,6 +141,7 @@ def init_db(force: bool = False) -> None:
                 missing = [h for h in headers if h not in first_row]
                 if missing:
                     ws.update("1:1", [first_row + missing])
+                    _cached_headers.clear()
 
     st.session_state["_transit_db_inited"] = True
 
@@ -158,8 +173,65 @@ def _bump_rev(tab: str) -> None:
     st.session_state[_rev_key(tab)] = _get_rev(tab) + 1
 
 
-@st.cache_data(ttl=30, show_spinner=False)
+READ_CACHE_TTL = 30  # segundos; mismo ttl que los st.cache_data de lectura
+
+# Prefetch por batchGet: (tab, rev) -> records ya leídos, que consume _cached_all_records en su miss.
+# _LOADED_AT recuerda cuándo se llenó cada (tab, rev) para no re-pedir lo que sigue en cache.
+_PREFETCHED: dict[tuple[str, int], tuple[float, list[dict[str, Any]]]] = {}
+_LOADED_AT: dict[tuple[str, int], float] = {}
+_PREFETCH_LOCK = threading.Lock()
+
+
+def _values_to_records(values: list[list[Any]]) -> list[dict[str, Any]]:
+    # Mismo resultado que ws.get_all_records(): filas rellenadas a lo ancho y numericise
+    if not values or not values[0]:
+        return []
+    keys = values[0]
+    width = len(keys)
+    return [
+        dict(zip(keys, numericise_all(row + [""] * (width - len(row)))))
+        for row in values[1:]
+    ]
+
+
+def prefetch_records(*tabs: str) -> None:
+    """
+    Trae en UNA llamada (values.batchGet) las pestañas cuyo cache (tab, rev) no está vivo,
+    para que las lecturas list_* siguientes no hagan una llamada HTTP por pestaña.
+    Si el batchGet falla, no pasa nada: cada lectura cae a su get_all_records normal.
+    """
+    init_db()
+    now = time.monotonic()
+    with _PREFETCH_LOCK:
+        for key in [k for k, t in _LOADED_AT.items() if now - t >= READ_CACHE_TTL]:
+            del _LOADED_AT[key]
+        for key in [k for k, (t, _) in _PREFETCHED.items() if now - t >= READ_CACHE_TTL]:
+            del _PREFETCHED[key]
+        stale = [
+            (tab, _get_rev(tab)) for tab in tabs
+            if (tab, _get_rev(tab)) not in _LOADED_AT
+        ]
+    if len(stale) < 2:
+        return  # 0 o 1 pestaña: la lectura normal ya es una sola llamada
+
+    try:
+        resp = _ss().values_batch_get([f"'{tab}'" for tab, _ in stale])
+    except (gspread.exceptions.APIError, requests.exceptions.RequestException, OSError):
+        return  # error de API o de red: las lecturas por pestaña hacen su propio intento
+
+    with _PREFETCH_LOCK:
+        for key, vr in zip(stale, resp.get("valueRanges", [])):
+            _PREFETCHED[key] = (now, _values_to_records(vr.get("values", [])))
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
 def _cached_all_records(tab: str, rev: int) -> list[dict[str, Any]]:
+    with _PREFETCH_LOCK:
+        _LOADED_AT[(tab, rev)] = time.monotonic()
+        prefetched = _PREFETCHED.pop((tab, rev), None)
+    if prefetched is not None and time.monotonic() - prefetched[0] < READ_CACHE_TTL:
+        return prefetched[1]
+
     ws = _ws(tab)
     last_err = None
     for attempt in range(6):
@@ -176,6 +248,53 @@ def _get_all_records(tab: str) -> list[dict[str, Any]]:
     return _cached_all_records(tab, _get_rev(tab))
 
 
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_record_by_id(tab: str, rev: int, id_col: str, key: str) -> dict[str, Any] | None:
+    # Una sola fila por (tab, rev, id): el hit de cache deserializa un dict, no la hoja entera
+    for r in _cached_all_records(tab, rev):
+        if str(r.get(id_col, "")) == key:
+            return r
+    return None
+
+
+def _get_record_by_id(tab: str, id_col: str, key: str) -> dict[str, Any] | None:
+    return _cached_record_by_id(tab, _get_rev(tab), id_col, str(key))
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_frame(tab: str, rev: int) -> pd.DataFrame:
+    # Mismo (tab, rev) que _cached_all_records: se invalida junto con él en cada escritura
+    # fillna una sola vez aquí (no en cada rerun en la página); cada hit de cache ya es copia propia
+    df = pd.DataFrame(_cached_all_records(tab, rev)).fillna("")
+    if tab == "cases" and "status" in df.columns:
+        # llave de estatus normalizada una vez, para filtrar sin recalcular en cada rerun
+        # (categórica: filtrar por estatus compara códigos enteros, no strings)
+        key = df["status"].astype(str).str.strip().str.lower().replace("", DEFAULT_STATUS.lower())
+        extra = sorted(set(key.unique()) - set(STATUS_KEYS))
+        df["status_key"] = pd.Categorical(key, categories=list(STATUS_KEYS) + extra)
+    if tab == "cases" and "case_id" in df.columns:
+        # Más recientes primero, ordenado una vez por rev (TR-AAAA-NNNNNN ordena bien como texto)
+        df = df.sort_values("case_id", ascending=False, ignore_index=True)
+    return df
+
+
+def _get_frame(tab: str) -> pd.DataFrame:
+    return _cached_frame(tab, _get_rev(tab))
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_case_frame(tab: str, rev: int, case_id: str) -> pd.DataFrame:
+    # Filtrado por trámite cacheado: cada hit deserializa solo las filas del trámite
+    df = _cached_frame(tab, rev)
+    if df.empty:
+        return df
+    return df[df["case_id"] == case_id]
+
+
+def _get_case_frame(tab: str, case_id: str) -> pd.DataFrame:
+    return _cached_case_frame(tab, _get_rev(tab), case_id)
+
+
 def _append(tab: str, row: list[Any]) -> None:
     ws = _ws(tab)
     last_err = None
@@ -190,6 +309,23 @@ def _append(tab: str, row: list[Any]) -> None:
     raise RuntimeError(f"Error append_row en '{tab}': {last_err}") from last_err
 
 
+def _append_many(tab: str, rows: list[list[Any]]) -> None:
+    # Igual que _append, pero N filas en una sola llamada (values.append)
+    if not rows:
+        return
+    ws = _ws(tab)
+    last_err = None
+    for attempt in range(6):
+        try:
+            ws.append_rows(rows, value_input_option="USER_ENTERED")
+            _bump_rev(tab)
+            return
+        except gspread.exceptions.APIError as e:
+            last_err = e
+            time.sleep(min((2 ** attempt) + random.uniform(0, 0.5), 10))
+    raise RuntimeError(f"Error append_rows en '{tab}': {last_err}") from last_err
+
+
 def _col_letter(n: int) -> str:
     s = ""
     while n:
@@ -203,23 +339,23 @@ def _col_letter(n: int) -> str:
 # -----------------------------
 def list_clients() -> pd.DataFrame:
     init_db()
-    return pd.DataFrame(_get_all_records("clients"))
+    return _get_frame("clients")
 
 
 def get_client(client_id: str) -> dict[str, Any] | None:
     init_db()
-    for r in _get_all_records("clients"):
-        if str(r.get("client_id","")) == str(client_id):
-            return r
-    return None
+    return _get_record_by_id("clients", "client_id", client_id)
 
 
 def search_clients(query: str) -> pd.DataFrame:
-    df = list_clients().fillna("")
+    df = list_clients()
     q = (query or "").strip().lower()
     if df.empty or not q:
         return df
-    mask = df.apply(lambda r: q in str(r.to_dict()).lower(), axis=1)
+    # Un texto por fila (columnas unidas) y un solo contains, sin apply(axis=1) por fila
+    cols = [df[c].astype(str).str.lower() for c in df.columns]
+    haystack = cols[0].str.cat(cols[1:], sep=" | ")
+    mask = haystack.str.contains(q, regex=False)
     return df[mask]
 
 
@@ -235,7 +371,7 @@ def upsert_client(
 ) -> str:
     init_db()
     ws = _ws("clients")
-    headers = _safe_get_row1(ws)
+    headers = _safe_get_row1(ws)  # fresca: la fila completa se escribe en orden de headers
     now = _now_iso()
 
     # leer registros (sin cache para update correcto)
@@ -297,7 +433,31 @@ def upsert_client(
 # -----------------------------
 def list_cases() -> pd.DataFrame:
     init_db()
-    return pd.DataFrame(_get_all_records("cases"))
+    return _get_frame("cases")
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_cases_overview(cases_rev: int, clients_rev: int) -> pd.DataFrame:
+    df = _cached_frame("cases", cases_rev)
+    clients = _cached_frame("clients", clients_rev)
+    if df.empty or clients.empty or "client_id" not in df.columns:
+        return df
+    # primer match por client_id: un client_id repetido no debe duplicar trámites
+    m = clients[["client_id", "name"]].drop_duplicates("client_id")
+    m.columns = ["client_id", "client_name"]
+    out = df.merge(m, on="client_id", how="left")
+    # trámite cuyo cliente ya no existe: nombre vacío (no "nan" en etiquetas ni búsqueda)
+    out["client_name"] = out["client_name"].fillna("")
+    return out
+
+
+def list_cases_overview() -> pd.DataFrame:
+    """
+    Cases + client_name, listo para el listado. Se recalcula solo cuando cambia
+    el rev de 'cases' o 'clients' (o vence el TTL).
+    """
+    init_db()
+    return _cached_cases_overview(_get_rev("cases"), _get_rev("clients"))
 
 
 def create_case(
@@ -308,13 +468,22 @@ def create_case(
     case_date: Optional[str] = None,
     status: str = DEFAULT_STATUS,
     drive_folder_id: str = "",
+    case_id: Optional[str] = None,
 ) -> str:
+    """
+    Si viene case_id (ya usado p.ej. para nombrar la carpeta en Drive) se respeta,
+    validando contra la hoja fresca que nadie lo haya tomado; si no, se calcula.
+    """
     init_db()
     ws = _ws("cases")
     records = ws.get_all_records()
     existing_ids = [r.get("case_id","") for r in records]
-    year = datetime.now().year
-    case_id = next_case_id(existing_ids, year=year)
+    if case_id:
+        if case_id in {str(x).strip() for x in existing_ids}:
+            raise ValueError(f"El case_id {case_id} ya existe (otro usuario lo acaba de crear). Intenta de nuevo.")
+    else:
+        year = datetime.now().year
+        case_id = next_case_id(existing_ids, year=year)
 
     now = _now_iso()
     cdate = case_date or datetime.now().date().isoformat()
@@ -326,10 +495,7 @@ def create_case(
 
 def get_case(case_id: str) -> dict[str, Any] | None:
     init_db()
-    for r in _get_all_records("cases"):
-        if str(r.get("case_id","")) == str(case_id):
-            return r
-    return None
+    return _get_record_by_id("cases", "case_id", case_id)
 
 
 def update_case_fields(case_id: str, fields: dict) -> None:
@@ -338,32 +504,48 @@ def update_case_fields(case_id: str, fields: dict) -> None:
     - NO usa ws.find() (frágil)
     - Busca el case_id leyendo toda la columna case_id y calcula row exacto.
     """
-    init_db()
-    ws = _ws("cases")
-    headers = _safe_get_row1(ws)
-    if "case_id" not in headers:
-        raise RuntimeError("La hoja 'cases' no tiene columna case_id.")
-
-    col_case_id = headers.index("case_id") + 1
+    update_many([(case_id, fields)])
 
-    col_vals = ws.col_values(col_case_id)  # incluye header
-    target = str(case_id).strip()
-    row_idx = None
-    for i, v in enumerate(col_vals, start=1):
-        if i == 1:
-            continue
-        if str(v).strip() == target:
-            row_idx = i
-            break
 
-    if row_idx is None:
-        raise ValueError(f"case_id no encontrado en sheet: {case_id}")
+def update_many(writes: list[tuple[str, dict]]) -> None:
+    """
+    Varias actualizaciones de trámites (case_id, fields) en UNA sola escritura:
+    1 lectura (fila 1 + columna case_id en un batchGet) + 1 batch_update, sin importar
+    cuántos trámites o campos vengan. Si algún case_id no existe no se escribe nada.
+    """
+    init_db()
+    ws = _ws("cases")
+    headers = _cached_headers("cases")
+    col_case_id = headers.index("case_id") + 1 if "case_id" in headers else 1
+
+    # La fila 1 fresca viaja en la misma lectura que la columna case_id: si alguien editó los
+    # headers a mano, se escribe con los actuales y no en columnas equivocadas del cache.
+    col = _col_letter(col_case_id)
+    row1, id_rows = ws.batch_get(["1:1", f"{col}:{col}"])
+    col_vals = [r[0] if r else "" for r in id_rows]  # incluye header
+    fresh = row1[0] if row1 else []
+    if fresh != headers:
+        _cached_headers.clear()
+        headers = fresh
+        if "case_id" not in headers:
+            raise RuntimeError("La hoja 'cases' no tiene columna case_id.")
+        if headers.index("case_id") + 1 != col_case_id:
+            col_case_id = headers.index("case_id") + 1
+            col_vals = ws.col_values(col_case_id)
+
+    row_by_id: dict[str, int] = {}
+    for i, v in enumerate(col_vals[1:], start=2):
+        row_by_id.setdefault(str(v).strip(), i)
 
     updates = []
-    for k, v in (fields or {}).items():
-        if k in headers:
-            col = headers.index(k) + 1
-            updates.append((row_idx, col, "" if v is None else str(v)))
+    for case_id, fields in writes:
+        row_idx = row_by_id.get(str(case_id).strip())
+        if row_idx is None:
+            raise ValueError(f"case_id no encontrado en sheet: {case_id}")
+        for k, v in (fields or {}).items():
+            if k in headers:
+                col = headers.index(k) + 1
+                updates.append((row_idx, col, "" if v is None else str(v)))
 
     if not updates:
         return
@@ -378,20 +560,36 @@ def update_case_fields(case_id: str, fields: dict) -> None:
 # -----------------------------
 def list_vehicles(case_id: Optional[str] = None) -> pd.DataFrame:
     init_db()
-    df = pd.DataFrame(_get_all_records("vehicles"))
-    if df.empty:
-        return df
     if case_id:
-        return df[df["case_id"] == case_id]
-    return df
+        return _get_case_frame("vehicles", case_id)
+    return _get_frame("vehicles")
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_case_vins(rev: int, case_id: str) -> list[str]:
+    df = _cached_case_frame("vehicles", rev, case_id)
+    if "vin" not in df.columns:
+        return []
+    return [v for v in df["vin"].astype(str).tolist() if v]
+
+
+def list_case_vins(case_id: str) -> list[str]:
+    """
+    VINs de los vehículos del trámite (opciones de VIN padre). Cacheado por (rev, case_id):
+    solo se recalcula cuando se escribe en 'vehicles'.
+    """
+    init_db()
+    return _cached_case_vins(_get_rev("vehicles"), case_id)
 
 
 def _vin_exists_global(vin: str) -> bool:
     v = normalize_vin(vin)
-    for r in _get_all_records("vehicles"):
-        if normalize_vin(str(r.get("vin",""))) == v:
-            return True
-    return False
+    df = _get_frame("vehicles")
+    if df.empty or "vin" not in df.columns:
+        return False
+    # Misma normalización que normalize_vin, pero en una pasada sobre la columna
+    vins = df["vin"].astype(str).str.strip().str.upper().str.replace(r"[^A-Z0-9]", "", regex=True)
+    return bool((vins == v).any())
 
 
 def add_vehicle(
@@ -414,7 +612,7 @@ def add_vehicle(
 ) -> str:
     init_db()
     v = normalize_vin(vin)
-    if not is_valid_vin(v) or len(v) != 17:
+    if not is_valid_vin(v):
         raise ValueError("VIN inválido. Debe tener 17 caracteres y no incluir I/O/Q.")
     if _vin_exists_global(v):
         raise ValueError("Este VIN ya existe en el sistema (no se puede duplicar).")
@@ -439,12 +637,9 @@ def add_vehicle(
 # -----------------------------
 def list_articles(case_id: Optional[str] = None) -> pd.DataFrame:
     init_db()
-    df = pd.DataFrame(_get_all_records("articles"))
-    if df.empty:
-        return df
     if case_id:
-        return df[df["case_id"] == case_id]
-    return df
+        return _get_case_frame("articles", case_id)
+    return _get_frame("articles")
 
 
 def _next_seq_for_case(case_id: str) -> str:
@@ -502,10 +697,12 @@ def add_article(
 # -----------------------------
 def list_documents(case_id: str) -> pd.DataFrame:
     init_db()
-    df = pd.DataFrame(_get_all_records("documents"))
-    if df.empty:
-        return df
-    return df[df["case_id"] == case_id]
+    return _get_case_frame("documents", case_id)
+
+
+# Las subidas en segundo plano registran su documento desde varios threads a la vez:
+# leer ids + append va bajo este lock para que dos threads no tomen el mismo doc_id.
+_DOCS_LOCK = threading.Lock()
 
 
 def add_document(
@@ -516,9 +713,33 @@ def add_document(
 ) -> str:
     init_db()
     ws = _ws("documents")
-    existing_doc_ids = [r.get("doc_id","") for r in ws.get_all_records()]
-    doc_id = next_doc_id(existing_doc_ids)
-    now = _now_iso()
-    row = [doc_id, case_id, doc_type, drive_file_id, file_name, now]
-    _append("documents", row)
+    with _DOCS_LOCK:
+        existing_doc_ids = [r.get("doc_id","") for r in ws.get_all_records()]
+        doc_id = next_doc_id(existing_doc_ids)
+        now = _now_iso()
+        row = [doc_id, case_id, doc_type, drive_file_id, file_name, now]
+        _append("documents", row)
     return doc_id
+
+
+def add_documents(docs: list[dict[str, str]]) -> list[str]:
+    """
+    Registra varios documentos (dicts con case_id, drive_file_id, file_name, doc_type)
+    con una lectura de ids y UN append: N subidas terminadas = 1 escritura, no N.
+    """
+    if not docs:
+        return []
+    init_db()
+    ws = _ws("documents")
+    with _DOCS_LOCK:
+        existing_doc_ids = [r.get("doc_id","") for r in ws.get_all_records()]
+        now = _now_iso()
+        rows, doc_ids = [], []
+        doc_id = next_doc_id(existing_doc_ids)
+        for d in docs:
+            if doc_ids:
+                doc_id = next_doc_id([doc_id])  # consecutivos, sin volver a recorrer todos los ids
+            doc_ids.append(doc_id)
+            rows.append([doc_id, d["case_id"], d["doc_type"], d["drive_file_id"], d["file_name"], now])
+        _append_many("documents", rows)
+    return doc_ids
@@ -4,15 +4,22 @@ from __future__ import annotations
 import re
 from typing import List
 
+# Compiladas una vez a nivel de módulo (antes se compilaban en cada llamada)
+_CASE_ID_RE = re.compile(r"^TR-(\d{4})-(\d{6})$", re.ASCII)
+_VEHICLE_ID_RE = re.compile(r"^VH-\d{6}$", re.ASCII)
+_ARTICLE_ID_RE = re.compile(r"^AR-\d{6}$", re.ASCII)
+_DOC_ID_RE = re.compile(r"^DC-\d{6}$", re.ASCII)
+
 
 def next_case_id(existing_case_ids: List[str], year: int) -> str:
     mx = 0
-    pat = re.compile(rf"^TR-{year}-\d{{6}}$")
+    yr = str(year)
     for cid in existing_case_ids or []:
         cid = str(cid).strip()
-        if pat.match(cid):
+        m = _CASE_ID_RE.match(cid)
+        if m and m.group(1) == yr:
             try:
-                mx = max(mx, int(cid.split("-")[-1]))
+                mx = max(mx, int(m.group(2)))
             except Exception:
                 pass
     return f"TR-{year}-{mx+1:06d}"
@@ -20,7 +27,7 @@ def next_case_id(existing_case_ids: List[str], year: int) -> str:
 
 def next_vehicle_id(existing_ids: List[str]) -> str:
     mx = 0
-    pat = re.compile(r"^VH-\d{6}$")
+    pat = _VEHICLE_ID_RE
     for x in existing_ids or []:
         s = str(x).strip()
         if pat.match(s):
@@ -33,7 +40,7 @@ def next_vehicle_id(existing_ids: List[str]) -> str:
 
 def next_article_id(existing_ids: List[str]) -> str:
     mx = 0
-    pat = re.compile(r"^AR-\d{6}$")
+    pat = _ARTICLE_ID_RE
     for x in existing_ids or []:
         s = str(x).strip()
         if pat.match(s):
@@ -46,7 +53,7 @@ def next_article_id(existing_ids: List[str]) -> str:
 
 def next_doc_id(existing_doc_ids: List[str]) -> str:
     mx = 0
-    pat = re.compile(r"^DC-\d{6}$")
+    pat = _DOC_ID_RE
     for x in existing_doc_ids or []:
         s = str(x).strip()
         if pat.match(s):
@@ -3,10 +3,13 @@ from __future__ import annotations
 
 from typing import Any, Dict, Optional, List
 from datetime import datetime
+from functools import lru_cache
+import re
 
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
 
 
 # ----------------------------
@@ -50,6 +53,26 @@ def _ensure_space(c: canvas.Canvas, y: float, need: float, page_w: float, page_h
     return y
 
 
+class _SummaryCanvas(canvas.Canvas):
+    """
+    Canvas que recuerda la última fuente emitida en la página: setFont escribe un operador Tf
+    en el stream cada vez, así que solo se emite al cambiar. La página nueva empieza sin fuente.
+    Lleva su propio estado (no los atributos internos de ReportLab).
+    """
+
+    _current_font: Optional[tuple] = None
+
+    def setFont(self, psfontname, size, leading=None):
+        key = (psfontname, size, leading)
+        if key != self._current_font:
+            super().setFont(psfontname, size, leading)
+            self._current_font = key
+
+    def showPage(self):
+        super().showPage()
+        self._current_font = None
+
+
 def _line(
     c: canvas.Canvas,
     text: str,
@@ -74,6 +97,13 @@ def _section_title(c: canvas.Canvas, text: str, y: float, page_w: float, page_h:
     return y
 
 
+@lru_cache(maxsize=4096)
+def _text_units(text: str, font: str) -> float:
+    # Ancho en unidades de glifo (tamaño 1000). Las mismas palabras (etiquetas, marcas,
+    # unidades) se repiten en todo el PDF y entre PDFs.
+    return stringWidth(text, font, 1000)
+
+
 def _wrap_paragraph(
     c: canvas.Canvas,
     text: str,
@@ -93,29 +123,52 @@ def _wrap_paragraph(
     if not text:
         return y
 
-    c.setFont(font, size)
-    words = text.split()
-    line = ""
+    # Ancho por palabra (cacheado) y acumulado: no se re-mide la línea completa en cada palabra.
+    # Se suma en unidades de glifo (1/1000 em, aditivo en las fuentes base); solo si el total
+    # cae justo en el borde se mide la línea real, para cortar exactamente igual que antes.
+    space_u = _text_units(" ", font)
     lines: List[str] = []
-
-    for w in words:
-        test = (line + " " + w).strip()
-        if c.stringWidth(test, font, size) <= max_width:
-            line = test
+    cur: List[str] = []
+    cur_u = 0.0
+
+    for w in text.split():
+        w_u = _text_units(w, font)
+        if not cur:
+            cur, cur_u = [w], w_u
+            continue
+        est = size * (cur_u + space_u + w_u) / 1000
+        if abs(est - max_width) < 1e-6:
+            fits = c.stringWidth(" ".join(cur) + " " + w, font, size) <= max_width
+        else:
+            fits = est <= max_width
+        if fits:
+            cur.append(w)
+            cur_u += space_u + w_u
         else:
-            if line:
-                lines.append(line)
-            line = w
+            lines.append(" ".join(cur))
+            cur, cur_u = [w], w_u
 
-    if line:
-        lines.append(line)
+    if cur:
+        lines.append(" ".join(cur))
 
+    # Las líneas de una misma página van en un solo text object (un BT/ET y T* por línea)
+    # en vez de un drawString con posicionamiento propio por línea.
+    t = None
     for ln in lines:
-        y = _ensure_space(c, y, leading + 2, page_w, page_h)
-        c.setFont(font, size)
-        c.drawString(x, y, ln)
+        if y - (leading + 2) < MARGIN_B:
+            if t is not None:
+                c.drawText(t)
+                t = None
+            y = _new_page(c, page_w, page_h)
+        if t is None:
+            c.setFont(font, size)
+            t = c.beginText(x, y)
+            t.setLeading(leading)
+        t.textLine(ln)
         y -= leading
 
+    if t is not None:
+        c.drawText(t)
     return y
 
 
@@ -123,6 +176,7 @@ def _wrap_paragraph(
 # Normalización Documentos
 # ----------------------------
 DOC_TYPES = ["ID_CLIENTE", "TITULO_VEHICULO", "FACTURA_VEHICULO", "FACTURA_ARTICULO", "OTRO"]
+_DRIVE_ID_RE = re.compile(r"[A-Za-z0-9_\-]+")
 
 
 def _looks_like_drive_id(s: str) -> bool:
@@ -130,8 +184,7 @@ def _looks_like_drive_id(s: str) -> bool:
     if len(s) < 18:
         return False
     # Drive id típico: letras/números/guiones/guion bajo
-    import re
-    return bool(re.fullmatch(r"[A-Za-z0-9_\-]+", s))
+    return bool(_DRIVE_ID_RE.fullmatch(s))
 
 
 def _doc_type_from_row(row: Dict[str, Any]) -> str:
@@ -156,6 +209,30 @@ def _doc_type_from_row(row: Dict[str, Any]) -> str:
     return dt or "OTRO"
 
 
+# ----------------------------
+# DataFrames -> registros
+# ----------------------------
+_VEHICLE_PDF_COLS = (
+    "vin", "brand", "model", "year", "trim", "engine", "vehicle_type", "body_class",
+    "plant_country", "gvwr", "weight", "created_at", "registered_at", "added_at",
+)
+_ARTICLE_PDF_COLS = ("description", "created_at", "registered_at", "added_at")
+_DOCUMENT_PDF_COLS = ("doc_type", "drive_file_id", "file_name", "uploaded_at", "created_at", "registered_at")
+
+
+def _records(df, cols) -> List[Dict[str, Any]]:
+    """
+    fillna + to_dict solo sobre las columnas que usa el PDF (las hojas traen muchas más,
+    p.ej. el JSON decodificado del VIN), en una pasada vectorizada.
+    """
+    if df is None:
+        return []
+    try:
+        return df[df.columns.intersection(cols, sort=False)].fillna("").to_dict("records")
+    except Exception:
+        return []
+
+
 # ----------------------------
 # Public API
 # ----------------------------
@@ -196,32 +273,15 @@ def build_case_summary_pdf_bytes(
     created_at = _safe(case.get("created_at")) or ""
     updated_at = _safe(case.get("updated_at")) or ""
 
-    # --- DataFrames a lista de dicts
-    vehicles = []
-    if vehicles_df is not None:
-        try:
-            vehicles = vehicles_df.fillna("").to_dict("records")
-        except Exception:
-            vehicles = []
-
-    articles = []
-    if articles_df is not None:
-        try:
-            articles = articles_df.fillna("").to_dict("records")
-        except Exception:
-            articles = []
-
-    documents = []
-    if documents_df is not None:
-        try:
-            documents = documents_df.fillna("").to_dict("records")
-        except Exception:
-            documents = []
+    # --- DataFrames a lista de dicts (solo las columnas que se imprimen)
+    vehicles = _records(vehicles_df, _VEHICLE_PDF_COLS)
+    articles = _records(articles_df, _ARTICLE_PDF_COLS)
+    documents = _records(documents_df, _DOCUMENT_PDF_COLS)
 
     # --- Canvas
     from io import BytesIO
     buff = BytesIO()
-    c = canvas.Canvas(buff, pagesize=PAGE_SIZE)
+    c = _SummaryCanvas(buff, pagesize=PAGE_SIZE)
     page_w, page_h = PAGE_SIZE
     usable_w = page_w - MARGIN_L - MARGIN_R
 
@@ -234,7 +294,6 @@ def build_case_summary_pdf_bytes(
     c.drawString(MARGIN_L, y, "RESUMEN DEL TRÁMITE")
     y -= 18
 
-    c.setFont(FONT, BODY_SIZE)
     y = _line(c, f"Trámite: {case_id}", MARGIN_L, y, font=FONT_BOLD, size=BODY_SIZE)
     y = _line(c, f"Cliente: {resolved_client_name or '-'}", MARGIN_L, y)
     y = _line(c, f"Estatus: {status}", MARGIN_L, y)
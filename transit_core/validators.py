@@ -1,9 +1,14 @@
 # transit_core/validators.py
 from __future__ import annotations
 import re
+from functools import lru_cache
 
 VIN_RE = re.compile(r"^[A-HJ-NPR-Z0-9]{17}$")  # excluye I,O,Q
+_NON_ALNUM_RE = re.compile(r"[^A-Z0-9]")
+_VIN_ALLOWED = frozenset("ABCDEFGHJKLMNPRSTUVWXYZ0123456789")  # mismo alfabeto que VIN_RE
+VIN_CACHE_SIZE = 4096  # funciones puras sobre strings cortos: se memorizan
 
+@lru_cache(maxsize=VIN_CACHE_SIZE)
 def normalize_vin(vin: str) -> str:
     """
     Normaliza un VIN:
@@ -12,9 +17,11 @@ def normalize_vin(vin: str) -> str:
     - deja solo A-Z y 0-9
     """
     v = (vin or "").strip().upper()
-    v = re.sub(r"[^A-Z0-9]", "", v)
+    v = _NON_ALNUM_RE.sub("", v)
     return v
 
+@lru_cache(maxsize=VIN_CACHE_SIZE)
 def is_valid_vin(vin: str) -> bool:
     v = normalize_vin(vin)
-    return bool(VIN_RE.fullmatch(v))
+    # Chequeo por set (en C) en vez de pasar por el motor de regex
+    return len(v) == 17 and _VIN_ALLOWED.issuperset(v)
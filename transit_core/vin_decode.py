@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from typing import Dict, Any, Optional, Tuple
 import time
-import hashlib
 import requests
 
 from requests.adapters import HTTPAdapter
@@ -53,6 +52,7 @@ RETRIES_TOTAL = 3
 BACKOFF_FACTOR = 0.6
 
 CACHE_TTL_SECONDS = 60 * 60 * 24 * 30  # 30 días
+CACHE_MAX_ENTRIES = 2048
 
 # Circuit breaker: si hay muchos fallos seguidos, no pegues a NHTSA por un rato
 CB_FAIL_THRESHOLD = 5
@@ -63,8 +63,9 @@ CB_OPEN_SECONDS = 120
 # Cache simple en memoria
 # -------------------------
 class _TTLCache:
-    def __init__(self, ttl_seconds: int):
+    def __init__(self, ttl_seconds: int, max_entries: int):
         self.ttl = ttl_seconds
+        self.max_entries = max_entries
         self._data: Dict[str, Tuple[float, Dict[str, Any]]] = {}
 
     def get(self, key: str) -> Optional[Dict[str, Any]]:
@@ -78,10 +79,14 @@ class _TTLCache:
         return val
 
     def set(self, key: str, val: Dict[str, Any]) -> None:
+        self._data.pop(key, None)
         self._data[key] = (time.time(), val)
+        # dict mantiene orden de inserción: el primero es el más viejo
+        while len(self._data) > self.max_entries:
+            self._data.pop(next(iter(self._data)))
 
 
-_cache = _TTLCache(CACHE_TTL_SECONDS)
+_cache = _TTLCache(CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES)
 
 
 # -------------------------
@@ -164,11 +169,6 @@ def _first_nonempty(row: dict, keys: list[str]) -> str:
     return ""
 
 
-def _cache_key(vin: str) -> str:
-    # SHA1 por simplicidad y porque es interno
-    return hashlib.sha1(vin.encode("utf-8")).hexdigest()
-
-
 # -------------------------
 # NHTSA decode (robusto)
 # -------------------------
@@ -263,8 +263,8 @@ def decode_vin(vin: str) -> Dict[str, Any]:
     if not is_valid_vin(v):
         return {"error": "VIN inválido (A-Z/0-9, sin I/O/Q)", "version": VIN_DECODE_VERSION}
 
-    # 1) cache
-    ck = _cache_key(v)
+    # 1) cache (el VIN normalizado ya es una llave corta y única)
+    ck = v
     cached = _cache.get(ck)
     if cached:
         return cached